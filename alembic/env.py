@@ -14,8 +14,9 @@ if not config.get_main_option('sqlalchemy.url'):
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
+# Keep the app's loggers working when migrations run in-process (e.g. tests).
 if config.config_file_name is not None:
-    fileConfig(config.config_file_name)
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
 
 # add your model's MetaData object here
 # for 'autogenerate' support
@@ -0,0 +1,45 @@
+"""match indexes to query shapes
+
+Revision ID: 021968c97f16
+Revises: 4669a970ec1a
+Create Date: 2026-10-18 17:11:02.392843
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision: str = '021968c97f16'
+down_revision: Union[str, Sequence[str], None] = '4669a970ec1a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY keeps the tables writable while indexes build, but it can't
+    # run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_post_owner_id'), 'post', ['owner_id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_post_published_created_at_id', 'post', ['published', 'created_at', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_vote_post_id'), 'vote', ['post_id'], unique=False, postgresql_concurrently=True)
+        # The primary keys already index id, and titles are searched through
+        # search_vector
+        op.drop_index(op.f('ix_post_id'), table_name='post', postgresql_concurrently=True)
+        op.drop_index(op.f('ix_post_title'), table_name='post', postgresql_concurrently=True)
+        op.drop_index(op.f('ix_user_id'), table_name='user', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_post_id'), 'post', ['id'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_post_title'), 'post', ['title'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_user_id'), 'user', ['id'], unique=False, postgresql_concurrently=True)
+        op.drop_index(op.f('ix_vote_post_id'), table_name='vote', postgresql_concurrently=True)
+        op.drop_index('ix_post_published_created_at_id', table_name='post', postgresql_concurrently=True)
+        op.drop_index(op.f('ix_post_owner_id'), table_name='post', postgresql_concurrently=True)
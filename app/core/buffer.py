@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Hashable
+
+from app.core.metrics import BUFFERED_WRITES_DROPPED
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBuffer[K: Hashable, V]:
+    """Holds writes in memory and hands them to `flush` in batches.
+
+    A later write to the same key replaces the earlier one. A batch is flushed
+    once it holds `max_items` keys or its first write is `max_delay` seconds
+    old, whichever comes first. A failed flush is retried with exponential
+    backoff, holding back later batches, and dropped after `max_attempts`.
+    Writes still buffered when a worker dies are lost, so `max_delay` bounds
+    both the added latency and the loss.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[dict[K, V]], Awaitable[None]],
+        *,
+        max_items: int,
+        max_delay: float,
+        max_attempts: int,
+        retry_delay: float,
+    ) -> None:
+        self._flush = flush
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.flushes = 0
+        self._pending: dict[K, V] = {}
+        self._timer: asyncio.Task[None] | None = None
+        self._flushing: set[asyncio.Task[None]] = set()
+        # Batches are written one at a time and in order, so a later write to
+        # a key can't land before an earlier one
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, key: K, value: V) -> None:
+        self._pending[key] = value
+        if len(self._pending) >= self.max_items:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.max_delay)
+        self._timer = None
+        self._start_flush()
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        # Runs beside the request that filled the batch instead of inside it
+        task = asyncio.create_task(self._write(batch))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _write(self, batch: dict[K, V]) -> None:
+        async with self._lock:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    await self._flush(batch)
+                except Exception:
+                    if attempt == self.max_attempts:
+                        BUFFERED_WRITES_DROPPED.inc(len(batch))
+                        logger.exception(
+                            "dropped %d buffered writes after %d attempts",
+                            len(batch),
+                            attempt,
+                        )
+                    else:
+                        # Still under the lock, so newer batches wait their turn
+                        await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+                else:
+                    break
+            self.flushes += 1
+
+    async def close(self) -> None:
+        """Flush what is buffered and wait for every flush to finish."""
+        if self._pending:
+            self._start_flush()
+        while self._flushing:
+            await asyncio.gather(*self._flushing)
@@ -0,0 +1,99 @@
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Protocol
+
+# Generations must outlive the entries filed under them
+GENERATION_TTL = 24 * 60 * 60
+
+
+class CacheBackend(Protocol):
+    """Key-value store with per-entry expiry, e.g. a shared Redis client."""
+
+    async def get(self, key: str) -> Any | None: ...
+
+    async def set(self, key: str, value: Any, ttl: float) -> None: ...
+
+    async def delete(self, key: str) -> None: ...
+
+
+class MemoryCache:
+    """Per-process LRU cache whose entries also expire after their TTL."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_nowait(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set_nowait(self, key: str, value: Any, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Any | None:
+        return self.get_nowait(key)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self.set_nowait(key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class NamespacedCache:
+    """Keys grouped under a generation, so a single write drops all of them.
+
+    Only plain get/set is needed from the backend, so invalidation also
+    reaches other workers when the backend is shared between them.
+    """
+
+    def __init__(self, backend: CacheBackend, namespace: str, ttl: float) -> None:
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+
+    async def _generation(self) -> str:
+        key = f"{self.namespace}:generation"
+        generation = await self.backend.get(key)
+        if generation is None:
+            generation = uuid.uuid4().hex
+            await self.backend.set(key, generation, ttl=GENERATION_TTL)
+        return generation
+
+    async def get(self, key: str) -> tuple[Any | None, str]:
+        """Return the value and the generation it was looked up in.
+
+        Pass the generation to `set`, so a value built while a write
+        invalidated the cache is filed under the old generation and never read.
+        """
+        generation = await self._generation()
+        value = await self.backend.get(f"{self.namespace}:{generation}:{key}")
+        return value, generation
+
+    async def set(self, key: str, value: Any, generation: str) -> None:
+        await self.backend.set(
+            f"{self.namespace}:{generation}:{key}", value, ttl=self.ttl
+        )
+
+    async def invalidate(self) -> None:
+        await self.backend.set(
+            f"{self.namespace}:generation", uuid.uuid4().hex, ttl=GENERATION_TTL
+        )
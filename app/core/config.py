@@ -1,10 +1,11 @@
 from typing import Annotated, Any
 
 from pydantic import AnyUrl, BeforeValidator, PostgresDsn, computed_field
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
 
 
-def parse_cors(v: Any) -> list[str] | str:
+def parse_list(v: Any) -> list[str] | str:
+    # Comma separated values, or a JSON list passed through as is
     if isinstance(v, str) and not v.startswith("["):
         return [i.strip() for i in v.split(",") if i.strip()]
     elif isinstance(v, list | str):
@@ -22,9 +23,69 @@ class Settings(BaseSettings):
 
     test_database_url: PostgresDsn | None
     database_url: PostgresDsn
+    # Comma separated, anonymous reads are spread over these when set
+    replica_database_urls: Annotated[
+        list[PostgresDsn], NoDecode, BeforeValidator(parse_list)
+    ] = []
+    # Per uvicorn worker, so the app can open up to
+    # workers * (db_pool_size + db_max_overflow) connections
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_timeout_ms: int = 0
+    # Behind PgBouncer (e.g. Neon's pooled endpoint) leave pooling to it
+    db_pgbouncer: bool = False
+    # Statements slower than this are logged, with the types and lengths of
+    # their parameters or, when enabled, the values inlined
+    db_slow_query_ms: float = 200.0
+    db_slow_query_log_parameters: bool = False
+    log_level: str = "INFO"
+    # Served by app.metrics_server, kept off the public port
+    metrics_port: int = 9091
+    health_check_timeout_seconds: float = 1.0
+    health_check_cache_seconds: float = 5.0
     secret_key: str
     access_token_expire_minutes: int
-    cors_origins: Annotated[list[AnyUrl] | str, BeforeValidator(parse_cors)] = []
+    user_cache_ttl_seconds: int = 60
+    user_cache_max_size: int = 10_000
+    token_revocation_max_size: int = 100_000
+    token_cache_max_size: int = 10_000
+    feed_cache_ttl_seconds: int = 10
+    feed_cache_max_size: int = 1_000
+    bulk_create_max_items: int = 10_000
+    vote_batch_max_items: int = 1_000
+    # Rows per multi-row INSERT, well under Postgres' 65535 bind parameters
+    bulk_create_chunk_size: int = 1_000
+    # Rows fetched per round trip by streaming exports
+    export_batch_size: int = 1_000
+    # A trending post's weight halves every half-life, and posts older than
+    # the window drop out. Scores are brought up to date every refresh
+    trending_half_life_hours: float = 12.0
+    trending_window_hours: float = 72.0
+    trending_refresh_seconds: float = 30.0
+    # Background jobs, per uvicorn worker. Eager runs them inline, for tests
+    job_queue_max_size: int = 10_000
+    job_batch_size: int = 100
+    job_max_attempts: int = 3
+    job_retry_delay_seconds: float = 0.5
+    job_drain_timeout_seconds: float = 10.0
+    jobs_eager: bool = False
+    # Lets functions registered with jobs.durable queue in the job table
+    jobs_durable: bool = False
+    job_poll_interval_seconds: float = 1.0
+    # Trades durability for commits: single votes are acknowledged with 202
+    # and written in batches, and a crashed worker loses up to max_delay_ms
+    vote_buffer_enabled: bool = False
+    vote_buffer_max_items: int = 1_000
+    vote_buffer_max_delay_ms: float = 50.0
+    vote_buffer_max_attempts: int = 3
+    vote_buffer_retry_delay_ms: float = 100.0
+    password_hash_workers: int = 2
+    auth_max_concurrency: int = 8
+    auth_queue_timeout_seconds: float = 2.0
+    cors_origins: Annotated[list[AnyUrl] | str, BeforeValidator(parse_list)] = []
 
     @computed_field
     @property
@@ -1,5 +1,205 @@
-from sqlmodel import create_engine
+import logging
+import time
+from collections.abc import Mapping, Sized
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any
+
+import psycopg
+from pydantic import PostgresDsn
+from sqlalchemy import event, exc
+from sqlalchemy.engine import URL, Connection, ExecutionContext, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, PoolProxiedConnection
 
 from app.core.config import config
+from app.core.metrics import (
+    POOL_CHECKOUT_WAIT,
+    POOL_CONNECTIONS_IN_USE,
+    POOL_TIMEOUTS,
+)
+
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long requests wait for a connection."""
+
+    def connect(self) -> PoolProxiedConnection:
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            pool_stats.timeouts += 1
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            pool_stats.checkouts += 1
+            pool_stats.wait_seconds += waited
+            pool_stats.max_wait_seconds = max(pool_stats.max_wait_seconds, waited)
+            POOL_CHECKOUT_WAIT.observe(waited)
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    seconds: float = 0.0
+    slowest_seconds: float = 0.0
+    slowest_statement: str | None = None
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+
+# Set per request by QueryStatsMiddleware, statements outside one go unrecorded
+query_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+logger = logging.getLogger(__name__)
+
+
+def _describe_parameter(value: Any) -> str:
+    if isinstance(value, Sized):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def _render_statement(
+    conn: Connection, statement: str, parameters: Any, executemany: bool
+) -> str:
+    if executemany or not parameters:
+        return statement
+    if not config.db_slow_query_log_parameters:
+        # Values can be emails or password hashes, only their shape is logged
+        if isinstance(parameters, Mapping):
+            described = [f"{k}={_describe_parameter(v)}" for k, v in parameters.items()]
+        else:
+            described = [_describe_parameter(value) for value in parameters]
+        return f"{statement}\n-- parameters: {', '.join(described)}"
+    # Inline the parameters psycopg would bind, so the SQL can be pasted
+    # straight after EXPLAIN ANALYZE
+    try:
+        return psycopg.AsyncClientCursor(conn.connection.driver_connection).mogrify(
+            statement, parameters
+        )
+    except psycopg.Error:
+        return statement
+
+
+def _before_cursor_execute(
+    _conn: Connection,
+    _cursor: Any,
+    _statement: str,
+    _parameters: Any,
+    context: ExecutionContext,
+    _executemany: bool,
+) -> None:
+    # Kept on the execution context, which is dropped if the statement fails
+    context.query_started = time.perf_counter()  # ty:ignore[unresolved-attribute]
+
+
+def _after_cursor_execute(
+    conn: Connection,
+    _cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: ExecutionContext,
+    executemany: bool,
+) -> None:
+    seconds = time.perf_counter() - context.query_started  # ty:ignore[unresolved-attribute]
+    stats = query_stats.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+    if config.db_slow_query_ms and seconds * 1000 >= config.db_slow_query_ms:
+        logger.warning(
+            "slow query duration_ms=%.1f\n%s",
+            seconds * 1000,
+            _render_statement(conn, statement, parameters, executemany),
+            extra={"duration_ms": round(seconds * 1000, 1)},
+        )
+
+
+def _checkout(*_args: Any) -> None:
+    POOL_CONNECTIONS_IN_USE.inc()
+
+
+def _checkin(*_args: Any) -> None:
+    POOL_CONNECTIONS_IN_USE.dec()
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine.sync_engine, "checkout", _checkout)
+    event.listen(engine.sync_engine, "checkin", _checkin)
+
+
+def get_async_database_url(database_url: PostgresDsn) -> URL:
+    # Route the configured DSN through psycopg's native asyncio driver
+    return make_url(str(database_url)).set(drivername="postgresql+psycopg")
+
+
+def create_db_engine(database_url: PostgresDsn) -> AsyncEngine:
+    if config.db_pgbouncer:
+        # PgBouncer rejects startup parameters it doesn't track, options among
+        # them, so the timeout has to be set on the role or database instead
+        if config.db_statement_timeout_ms:
+            logger.warning(
+                "DB_STATEMENT_TIMEOUT_MS is ignored with DB_PGBOUNCER, "
+                "set statement_timeout on the database role instead"
+            )
+        # PgBouncer owns pooling, and in transaction mode a server connection
+        # can't keep the prepared statements psycopg would otherwise create
+        return create_async_engine(
+            get_async_database_url(database_url),
+            poolclass=NullPool,
+            connect_args={"prepare_threshold": None},
+        )
+    connect_args: dict[str, Any] = {}
+    if config.db_statement_timeout_ms:
+        connect_args["options"] = (
+            f"-c statement_timeout={config.db_statement_timeout_ms}"
+        )
+    return create_async_engine(
+        get_async_database_url(database_url),
+        poolclass=InstrumentedPool,
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_max_overflow,
+        pool_timeout=config.db_pool_timeout,
+        pool_recycle=config.db_pool_recycle,
+        pool_pre_ping=config.db_pool_pre_ping,
+        connect_args=connect_args,
+    )
+
+
+engine = create_db_engine(config.database_url)
+instrument_engine(engine)
+
+replica_engines = [create_db_engine(url) for url in config.replica_database_urls]
+for replica_engine in replica_engines:
+    instrument_engine(replica_engine)
+
 
-engine = create_engine(str(config.database_url))
+def pool_status() -> dict[str, int]:
+    pool = engine.pool
+    if not isinstance(pool, AsyncAdaptedQueuePool):
+        return {}
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "checked_in": pool.checkedin(),
+    }
@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import time
+
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseProbe:
+    """Checks the database answers, reusing the last answer for `ttl` seconds.
+
+    Concurrent probes share a single check, so platform health checks cost
+    at most one pooled connection every `ttl` seconds per worker.
+    """
+
+    def __init__(self, engine: AsyncEngine, timeout: float, ttl: float) -> None:
+        self.engine = engine
+        self.timeout = timeout
+        self.ttl = ttl
+        self._ready = False
+        self._checked_at: float | None = None
+        self._lock = asyncio.Lock()
+
+    async def _check(self) -> bool:
+        try:
+            # Covers waiting for a pooled connection as well as the query
+            async with asyncio.timeout(self.timeout):
+                async with self.engine.connect() as connection:
+                    await connection.execute(text("SELECT 1"))
+        except (TimeoutError, exc.SQLAlchemyError) as e:
+            logger.warning("database probe failed: %r", e)
+            return False
+        return True
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._checked_at is not None
+            and time.monotonic() - self._checked_at < self.ttl
+        )
+
+    async def is_ready(self) -> bool:
+        if self._is_fresh():
+            return self._ready
+        async with self._lock:
+            # Another probe may have refreshed it while this one waited
+            if not self._is_fresh():
+                self._ready = await self._check()
+                self._checked_at = time.monotonic()
+        return self._ready
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import models
+from app.core.metrics import JOBS
+
+logger = logging.getLogger(__name__)
+
+type Job = tuple[Callable[..., Awaitable[Any]], tuple[Any, ...]]
+
+
+class JobRunner:
+    """Runs side effects of requests in the background, after the response.
+
+    Jobs wait in a bounded queue for one worker task, which takes up to
+    `batch_size` at a time and runs equal jobs in a batch once, so a burst of
+    `enqueue(feed_cache.invalidate)` costs a single invalidation. Jobs with
+    unhashable arguments are never considered equal. Failed jobs are retried
+    with exponential backoff, then logged and dropped.
+
+    Only for work that can be lost in a crash. With `eager` set, or before
+    `start()` and after `drain()`, jobs run inline instead.
+
+    Functions registered with `durable` are the exception once `engine` is
+    given: they are stored in the job table and survive restarts. Every
+    worker polls the table every `poll_interval` seconds and claims due jobs
+    with SKIP LOCKED, so each runs on one worker. Their arguments must be JSON
+    values, and a job may run twice when its worker stops mid batch.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_size: int,
+        batch_size: int,
+        max_attempts: int,
+        retry_delay: float,
+        eager: bool = False,
+        engine: AsyncEngine | None = None,
+        poll_interval: float = 1.0,
+    ) -> None:
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.eager = eager
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self._queue: asyncio.Queue[tuple[Job, int]] | None = None
+        self._worker: asyncio.Task[None] | None = None
+        self._poller: asyncio.Task[None] | None = None
+        self._wake = asyncio.Event()
+        self._closed = False
+        self._retries: set[asyncio.Task[None]] = set()
+        self._durable: dict[str, Callable[..., Awaitable[Any]]] = {}
+
+    def durable[F: Callable[..., Awaitable[Any]]](self, fn: F) -> F:
+        """Register `fn` to be queued in the job table, by its qualified name."""
+        self._durable[f"{fn.__module__}.{fn.__qualname__}"] = fn
+        return fn
+
+    def _durable_name(self, fn: Callable[..., Awaitable[Any]]) -> str | None:
+        name = f"{fn.__module__}.{fn.__qualname__}"
+        return name if self._durable.get(name) is fn else None
+
+    def start(self) -> None:
+        if self.eager:
+            return
+        self._closed = False
+        self._queue = asyncio.Queue(self.max_size)
+        self._worker = asyncio.create_task(self._work(self._queue))
+        if self.engine is not None:
+            self._wake = asyncio.Event()
+            self._poller = asyncio.create_task(self._poll(self.engine))
+
+    async def enqueue(self, fn: Callable[..., Awaitable[Any]], *args: Any) -> None:
+        job = (fn, args)
+        name = self._durable_name(fn)
+        if self.engine is not None and name is not None and not self.eager:
+            # Stored even before start(), any worker's poller will run it
+            async with AsyncSession(self.engine) as session:
+                session.add(models.Job(name=name, args=list(args)))
+                await session.commit()
+            return
+        if self._queue is None or self._closed:
+            await self._run(job, attempt=1)
+            return
+        try:
+            self._queue.put_nowait((job, 1))
+        except asyncio.QueueFull:
+            # Push back on the request rather than drop the work
+            JOBS.labels(result="inline").inc()
+            await self._run(job, attempt=1)
+
+    async def _run(self, job: Job, attempt: int) -> None:
+        fn, args = job
+        try:
+            await fn(*args)
+        except Exception:
+            if attempt >= self.max_attempts or self._worker is None:
+                JOBS.labels(result="failed").inc()
+                logger.exception("job %s failed after %d attempts", fn, attempt)
+                return
+            JOBS.labels(result="retried").inc()
+            task = asyncio.create_task(self._retry(job, attempt + 1))
+            self._retries.add(task)
+            task.add_done_callback(self._retries.discard)
+        else:
+            JOBS.labels(result="done").inc()
+
+    async def _retry(self, job: Job, attempt: int) -> None:
+        await asyncio.sleep(self.retry_delay * 2 ** (attempt - 2))
+        if self._queue is None:
+            await self._run(job, attempt)
+            return
+        try:
+            self._queue.put_nowait((job, attempt))
+        except asyncio.QueueFull:
+            await self._run(job, attempt)
+
+    async def _work(self, queue: asyncio.Queue[tuple[Job, int]]) -> None:
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            # Equal jobs in a batch run once, on their highest attempt
+            runs: list[tuple[Job, int]] = []
+            seen: dict[Job, int] = {}
+            for job, attempt in batch:
+                try:
+                    index = seen.get(job)
+                except TypeError:
+                    # Unhashable arguments, so it can't be matched and runs as is
+                    runs.append((job, attempt))
+                    continue
+                if index is None:
+                    seen[job] = len(runs)
+                    runs.append((job, attempt))
+                else:
+                    runs[index] = (job, max(attempt, runs[index][1]))
+            for job, attempt in runs:
+                await self._run(job, attempt)
+            for _ in batch:
+                queue.task_done()
+
+    async def _poll(self, engine: AsyncEngine) -> None:
+        while not self._closed:
+            try:
+                claimed = await self._run_durable(engine)
+            except exc.SQLAlchemyError:
+                logger.exception("claiming durable jobs failed")
+                claimed = 0
+            if not claimed:
+                with suppress(TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+
+    async def _run_durable(self, engine: AsyncEngine) -> int:
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            # Locked until the commit, other workers skip them meanwhile
+            due = (
+                await session.exec(
+                    select(models.Job)
+                    .where(col(models.Job.run_after) <= datetime.now(UTC))
+                    .order_by(col(models.Job.run_after), col(models.Job.id))
+                    .limit(self.batch_size)
+                    .with_for_update(skip_locked=True)
+                )
+            ).all()
+            for row in due:
+                fn = self._durable.get(row.name)
+                try:
+                    if fn is None:
+                        raise LookupError(f"no durable job named {row.name}")
+                    await fn(*row.args)
+                except Exception:
+                    row.attempts += 1
+                    if row.attempts < self.max_attempts:
+                        JOBS.labels(result="retried").inc()
+                        delay = self.retry_delay * 2 ** (row.attempts - 1)
+                        row.run_after = datetime.now(UTC) + timedelta(seconds=delay)
+                        session.add(row)
+                        continue
+                    JOBS.labels(result="failed").inc()
+                    logger.exception(
+                        "job %s failed after %d attempts", row.name, row.attempts
+                    )
+                else:
+                    JOBS.labels(result="done").inc()
+                await session.delete(row)
+            await session.commit()
+        return len(due)
+
+    async def drain(self, timeout: float) -> None:
+        """Stop taking jobs and finish the queued ones, waiting up to `timeout`.
+
+        Durable jobs stay in the table for the next start, only a batch being
+        run is waited for.
+        """
+        poller, self._poller = self._poller, None
+        queue, worker = self._queue, self._worker
+        if queue is None or worker is None:
+            return
+        # New jobs run inline from here, retries still go through the queue
+        self._closed = True
+        self._wake.set()
+        try:
+            async with asyncio.timeout(timeout):
+                if poller is not None:
+                    # Cut short, its batch rolls back and runs again later
+                    await poller
+                # Retries land back in the queue once their delay is up
+                while True:
+                    await queue.join()
+                    if not self._retries:
+                        break
+                    await asyncio.gather(*self._retries)
+        except TimeoutError:
+            logger.warning("dropped %d queued jobs on shutdown", queue.qsize())
+        worker.cancel()
+        if poller is not None:
+            poller.cancel()
+        self._queue = self._worker = None
+        for task in self._retries:
+            task.cancel()
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import threading
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+# With PROMETHEUS_MULTIPROC_DIR set, every uvicorn worker writes its samples
+# to files there and a scrape of any worker sums them (see entrypoint.sh)
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+REQUESTS = Counter(
+    "http_requests_total", "Requests handled", ["method", "route", "status"]
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time to the end of the response body",
+    ["method", "route"],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests being handled",
+    multiprocess_mode="livesum",
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection",
+    buckets=FAST_BUCKETS,
+)
+POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT"
+)
+POOL_CONNECTIONS_IN_USE = Gauge(
+    "db_pool_connections_in_use",
+    "Connections checked out of the pool",
+    multiprocess_mode="livesum",
+)
+PASSWORD_HASH_QUEUE = Histogram(
+    "password_hash_queue_seconds",
+    "Time waiting for a password hashing thread",
+    ["operation"],
+)
+PASSWORD_HASH_DURATION = Histogram(
+    "password_hash_duration_seconds",
+    "Time spent in Argon2",
+    ["operation"],
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+TOKEN_CACHE = Counter(
+    "token_cache_requests_total", "Access token lookups in the cache", ["result"]
+)
+JOBS = Counter("background_jobs_total", "Background jobs run", ["result"])
+BUFFERED_WRITES_DROPPED = Counter(
+    "buffered_writes_dropped_total", "Buffered writes lost to failed flushes"
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop woke a sleeping task, i.e. how long it was blocked",
+    buckets=FAST_BUCKETS,
+)
+
+
+async def monitor_event_loop_lag(interval: float = 0.5) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - started - interval, 0))
+
+
+def metrics_registry() -> CollectorRegistry:
+    if MULTIPROC_DIR is None:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=MULTIPROC_DIR)
+    return registry
+
+
+def render_metrics() -> tuple[bytes, str]:
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
+
+
+def serve_metrics(port: int) -> None:
+    """Serve the metrics on a port of their own until the process is stopped."""
+    start_http_server(port, registry=metrics_registry())
+    threading.Event().wait()
+
+
+def mark_process_dead() -> None:
+    # Drops this worker's live gauges, its counters keep counting towards totals
+    if MULTIPROC_DIR is not None:
+        multiprocess.mark_process_dead(os.getpid(), path=MULTIPROC_DIR)
@@ -0,0 +1,109 @@
+import logging
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.db import QueryStats, query_stats
+from app.core.metrics import REQUEST_DURATION, REQUESTS, REQUESTS_IN_PROGRESS
+
+logger = logging.getLogger(__name__)
+
+
+def server_timing(stats: QueryStats, total_seconds: float) -> str:
+    metrics = [
+        f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries"',
+        f"db-slowest;dur={stats.slowest_seconds * 1000:.1f}",
+        f"total;dur={total_seconds * 1000:.1f}",
+    ]
+    return ", ".join(metrics)
+
+
+class QueryStatsMiddleware:
+    """Count the statements each request runs and report their time.
+
+    Totals go out as a `Server-Timing` header and one log line per request.
+    Plain ASGI rather than BaseHTTPMiddleware, which would add a task and a
+    stream copy to every response.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    server_timing(stats, time.perf_counter() - started),
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            query_stats.reset(token)
+            duration_ms = round((time.perf_counter() - started) * 1000, 1)
+            logger.info(
+                "%s %s status=%d duration_ms=%.1f queries=%d db_ms=%.1f",
+                scope["method"],
+                scope["path"],
+                status_code,
+                duration_ms,
+                stats.count,
+                stats.seconds * 1000,
+                extra={
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status_code": status_code,
+                    "duration_ms": duration_ms,
+                    "queries": stats.count,
+                    "db_ms": round(stats.seconds * 1000, 1),
+                    "slowest_query_ms": round(stats.slowest_seconds * 1000, 1),
+                    "slowest_query": stats.slowest_statement,
+                },
+            )
+
+
+class MetricsMiddleware:
+    """Count requests and time them per route template, not per raw path."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_PROGRESS.dec()
+            # Set by the router once a route matched, keeps ids out of labels
+            route = scope.get("route")
+            route_path = getattr(route, "path", "<unmatched>")
+            REQUEST_DURATION.labels(scope["method"], route_path).observe(
+                time.perf_counter() - started
+            )
+            REQUESTS.labels(scope["method"], route_path, status_code).inc()
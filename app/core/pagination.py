@@ -0,0 +1,26 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+
+MAX_PAGE_SIZE = 100
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(
+    created_at: datetime, id: uuid.UUID, rank: float | None = None
+) -> str:
+    payload = json.dumps([created_at.isoformat(), str(id), rank], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID, float | None]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, id, rank = json.loads(base64.urlsafe_b64decode(padded))
+        if rank is not None:
+            rank = float(rank)
+        return datetime.fromisoformat(created_at), uuid.UUID(id), rank
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
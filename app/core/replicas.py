@@ -0,0 +1,27 @@
+from collections.abc import Sequence
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.health import DatabaseProbe
+
+
+class ReplicaRouter:
+    """Picks read replicas round-robin, passing over ones that fail their probe.
+
+    `engine()` returns None when there are no replicas or none is reachable,
+    and the caller reads from the primary instead.
+    """
+
+    def __init__(
+        self, engines: Sequence[AsyncEngine], timeout: float, ttl: float
+    ) -> None:
+        self.probes = [DatabaseProbe(engine, timeout, ttl) for engine in engines]
+        self._turn = 0
+
+    async def engine(self) -> AsyncEngine | None:
+        for _ in range(len(self.probes)):
+            probe = self.probes[self._turn % len(self.probes)]
+            self._turn += 1
+            if await probe.is_ready():
+                return probe.engine
+        return None
@@ -1,9 +1,18 @@
+import asyncio
+import hashlib
+import time
+import uuid
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import UTC, datetime, timedelta
 
 import jwt
 from pwdlib import PasswordHash
 
+from app.core.cache import CacheBackend, MemoryCache
 from app.core.config import config
+from app.core.metrics import PASSWORD_HASH_DURATION, PASSWORD_HASH_QUEUE, TOKEN_CACHE
 
 password_hash = PasswordHash.recommended()
 
@@ -19,6 +28,57 @@ def hash_password(password: str) -> str:
     return password_hash.hash(password)
 
 
+class PasswordHashPool:
+    """Runs Argon2 hashing on a bounded thread pool, away from the event loop."""
+
+    def __init__(self, max_workers: int) -> None:
+        self.max_workers = max_workers
+        self.pending = 0
+        self.completed = 0
+        self.queue_seconds = 0.0
+        self.hash_seconds = 0.0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password-hash"
+        )
+
+    async def _run[T](self, operation: str, fn: Callable[..., T], *args: str) -> T:
+        submitted = time.perf_counter()
+        self.pending += 1
+        try:
+            (
+                started,
+                result,
+                finished,
+            ) = await asyncio.get_running_loop().run_in_executor(
+                self._executor, _timed, fn, *args
+            )
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.queue_seconds += started - submitted
+        self.hash_seconds += finished - started
+        PASSWORD_HASH_QUEUE.labels(operation).observe(started - submitted)
+        PASSWORD_HASH_DURATION.labels(operation).observe(finished - started)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(
+            "verify", verify_password, plain_password, hashed_password
+        )
+
+
+def _timed[T](fn: Callable[..., T], *args: str) -> tuple[float, T, float]:
+    started = time.perf_counter()
+    result = fn(*args)
+    return started, result, time.perf_counter()
+
+
+password_hash_pool = PasswordHashPool(max_workers=config.password_hash_workers)
+
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -27,17 +87,91 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
         expire = datetime.now(UTC) + timedelta(
             minutes=config.access_token_expire_minutes
         )
-    to_encode.update({"exp": expire})
+    # A token id lets a single token be revoked on logout
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, config.secret_key, algorithm=ALGORITHM)
     return encoded_jwt
 
 
-def verify_token(token: str) -> str | None:
+@dataclass(frozen=True)
+class Principal:
+    """The caller as proven by a verified token, with no database read."""
+
+    id: uuid.UUID
+    token_id: str | None
+    token_version: int
+    expires_at: datetime
+
+
+# Verified tokens by digest, so repeat requests skip the signature check and
+# claim parsing until the token expires
+verified_tokens = MemoryCache(max_size=config.token_cache_max_size)
+
+
+def decode_token(token: str) -> Principal | None:
+    key = hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+    principal = verified_tokens.get_nowait(key)
+    TOKEN_CACHE.labels("miss" if principal is None else "hit").inc()
+    if principal is None:
+        principal = _decode_token(token)
+        if principal is not None:
+            ttl = principal.expires_at.timestamp() - time.time()
+            verified_tokens.set_nowait(key, principal, ttl=ttl)
+    return principal
+
+
+def _decode_token(token: str) -> Principal | None:
     try:
-        payload = jwt.decode(token, config.secret_key, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if username is None:
-            return None
-        return username
+        # PyJWT checks sub and jti are strings
+        payload = jwt.decode(
+            token,
+            config.secret_key,
+            algorithms=[ALGORITHM],
+            options={"require": ["exp", "sub"]},
+        )
     except jwt.PyJWTError:
         return None
+    try:
+        user_id = uuid.UUID(payload["sub"])
+    except ValueError:
+        return None
+    token_version = payload.get("ver", 0)
+    if not isinstance(token_version, int):
+        return None
+    return Principal(
+        id=user_id,
+        token_id=payload.get("jti"),
+        token_version=token_version,
+        expires_at=datetime.fromtimestamp(payload["exp"], UTC),
+    )
+
+
+class TokenRevocations:
+    """Tokens revoked before they expire, held in a cache backend.
+
+    Logging out denies one token by its id. Bumping a user's token version
+    denies every token issued to them before. Entries only need to outlive
+    the tokens they deny. A per-process backend only covers its own worker,
+    so use a shared one when running several.
+    """
+
+    def __init__(self, backend: CacheBackend) -> None:
+        self.backend = backend
+
+    async def revoke(self, principal: Principal) -> None:
+        ttl = (principal.expires_at - datetime.now(UTC)).total_seconds()
+        if principal.token_id and ttl > 0:
+            await self.backend.set(f"jti:{principal.token_id}", True, ttl=ttl)
+
+    async def revoke_before(self, user_id: uuid.UUID, token_version: int) -> None:
+        await self.backend.set(
+            f"ver:{user_id}",
+            token_version,
+            ttl=config.access_token_expire_minutes * 60,
+        )
+
+    async def is_revoked(self, principal: Principal) -> bool:
+        if principal.token_id and await self.backend.get(f"jti:{principal.token_id}"):
+            return True
+        min_version = await self.backend.get(f"ver:{principal.id}")
+        return min_version is not None and principal.token_version < min_version
@@ -0,0 +1,47 @@
+from collections.abc import Iterable, Mapping
+from typing import Any
+
+from fastapi import Response, status
+from pydantic import TypeAdapter
+
+
+class JSONBody:
+    """Serializes trusted values, like rows read from the database, to JSON.
+
+    For a `response_model` FastAPI validates the returned value, converts it to
+    plain Python data and passes that through `json.dumps`. This validates once,
+    straight from the row attributes, and lets pydantic-core write the bytes.
+    Returning its Response skips FastAPI's own pass, so keep `response_model` on
+    the route for the OpenAPI schema.
+    """
+
+    def __init__(self, type_: Any) -> None:
+        self.adapter = TypeAdapter(type_)
+
+    def dump(self, value: Any) -> bytes:
+        return self.adapter.dump_json(
+            self.adapter.validate_python(value, from_attributes=True)
+        )
+
+    def dump_lines(self, values: Iterable[Any]) -> bytes:
+        # One document per line, as in NDJSON
+        return b"".join(self.dump(value) + b"\n" for value in values)
+
+    def dump_python(self, value: Any) -> Any:
+        return self.adapter.dump_python(
+            self.adapter.validate_python(value, from_attributes=True), mode="json"
+        )
+
+    def response(
+        self,
+        value: Any,
+        *,
+        status_code: int = status.HTTP_200_OK,
+        headers: Mapping[str, str] | None = None,
+    ) -> Response:
+        return Response(
+            content=self.dump(value),
+            status_code=status_code,
+            headers=headers,
+            media_type="application/json",
+        )
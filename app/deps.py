@@ -1,40 +1,197 @@
-from collections.abc import Generator
+import uuid
+from collections.abc import AsyncGenerator, Generator
+from contextlib import contextmanager
 from typing import Annotated
 
+import psycopg
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlmodel import Session, select
+from sqlalchemy.exc import IntegrityError
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.core.db import engine
-from app.core.security import verify_token
+from app.core.cache import CacheBackend, MemoryCache, NamespacedCache
+from app.core.concurrency import ConcurrencyLimiter
+from app.core.config import config
+from app.core.db import engine, replica_engines
+from app.core.health import DatabaseProbe
+from app.core.jobs import JobRunner
+from app.core.replicas import ReplicaRouter
+from app.core.security import Principal, TokenRevocations, decode_token
 from app.models import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 TokenDep = Annotated[str, Depends(oauth2_scheme)]
 
+# For routes that serve anonymous callers too but say more to signed in ones
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
-def get_session() -> Generator[Session]:
-    with Session(engine) as session:
+OptionalTokenDep = Annotated[str | None, Depends(optional_oauth2_scheme)]
+
+# Resolved users keyed by token subject; swap in a shared backend to span workers
+user_cache: CacheBackend = MemoryCache(max_size=config.user_cache_max_size)
+
+# Revoked tokens; like user_cache, swap in a shared backend to span workers
+token_revocations = TokenRevocations(
+    MemoryCache(max_size=config.token_revocation_max_size)
+)
+
+# Serialized anonymous feed pages, dropped on every post or vote write
+feed_cache = NamespacedCache(
+    MemoryCache(max_size=config.feed_cache_max_size),
+    namespace="feed",
+    ttl=config.feed_cache_ttl_seconds,
+)
+
+# Side effects of writes that can run after the response, like invalidations
+jobs = JobRunner(
+    max_size=config.job_queue_max_size,
+    batch_size=config.job_batch_size,
+    max_attempts=config.job_max_attempts,
+    retry_delay=config.job_retry_delay_seconds,
+    eager=config.jobs_eager,
+    engine=engine if config.jobs_durable else None,
+    poll_interval=config.job_poll_interval_seconds,
+)
+
+# Backs /health/ready, cached so frequent probes barely touch the pool
+database_probe = DatabaseProbe(
+    engine,
+    timeout=config.health_check_timeout_seconds,
+    ttl=config.health_check_cache_seconds,
+)
+
+
+async def get_session() -> AsyncGenerator[AsyncSession]:
+    # Keep loaded attributes after commit, lazy refreshes can't run under asyncio
+    async with AsyncSession(engine, expire_on_commit=False) as session:
         yield session
 
 
-SessionDep = Annotated[Session, Depends(get_session)]
+SessionDep = Annotated[AsyncSession, Depends(get_session)]
+
+# Probed like the primary, a replica that stops answering is skipped until
+# its next probe succeeds
+read_replicas = ReplicaRouter(
+    replica_engines,
+    timeout=config.health_check_timeout_seconds,
+    ttl=config.health_check_cache_seconds,
+)
+
 
+# Bounds in-flight /register and /token calls, so their Argon2 work can't
+# starve the rest of the API during a credential-stuffing spike
+auth_limiter = ConcurrencyLimiter(
+    limit=config.auth_max_concurrency, timeout=config.auth_queue_timeout_seconds
+)
 
-async def get_current_user(token: TokenDep, session: SessionDep) -> User:
-    credentials_exception = HTTPException(
+
+async def limit_auth_concurrency() -> AsyncGenerator[None]:
+    if not await auth_limiter.acquire():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests, try again later",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        yield
+    finally:
+        auth_limiter.release()
+
+
+def _unauthorized() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid authentication credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    username = verify_token(token)
-    if username is None:
-        raise credentials_exception
-    user = session.exec(select(User).where(User.username == username)).first()
-    if not user:
-        raise credentials_exception
+
+
+# Foreign keys from rows written on behalf of the token's subject
+USER_FOREIGN_KEYS = {"post_owner_id_fkey", "vote_user_id_fkey"}
+
+
+@contextmanager
+def refuse_deleted_user() -> Generator[None]:
+    """Answer 401 when a write fails because its user has been deleted.
+
+    Writes trust the token's subject without loading the user, so the foreign
+    key is what notices a user deleted since their token was issued.
+    """
+    try:
+        yield
+    except IntegrityError as e:
+        if (
+            isinstance(e.orig, psycopg.errors.ForeignKeyViolation)
+            and e.orig.diag.constraint_name in USER_FOREIGN_KEYS
+        ):
+            raise _unauthorized() from e
+        raise
+
+
+async def get_current_principal(token: TokenDep) -> Principal:
+    principal = decode_token(token)
+    if principal is None or await token_revocations.is_revoked(principal):
+        raise _unauthorized()
+    return principal
+
+
+PrincipalDep = Annotated[Principal, Depends(get_current_principal)]
+
+
+async def get_optional_principal(token: OptionalTokenDep) -> Principal | None:
+    # A bad token is still refused, so clients notice instead of silently
+    # getting the anonymous view
+    if token is None:
+        return None
+    return await get_current_principal(token)
+
+
+OptionalPrincipalDep = Annotated[Principal | None, Depends(get_optional_principal)]
+
+
+async def get_current_user(principal: PrincipalDep, session: SessionDep) -> User:
+    cached_user = await user_cache.get(str(principal.id))
+    if cached_user is not None:
+        # Never written back, so the missing hash can't overwrite the real one
+        user = User.model_validate(cached_user, update={"hashed_password": ""})
+    else:
+        user = await session.get(User, principal.id)
+        if not user:
+            raise _unauthorized()
+        # The password hash stays out of the cache, nothing past login needs it
+        await user_cache.set(
+            str(principal.id),
+            user.model_dump(exclude={"hashed_password"}),
+            ttl=config.user_cache_ttl_seconds,
+        )
+    # The row has the final word when revocations were lost, e.g. on a restart
+    if principal.token_version < user.token_version:
+        raise _unauthorized()
     return user
 
 
+async def invalidate_user(user_id: uuid.UUID) -> None:
+    """Forget a cached user, call after any change to their account."""
+    await user_cache.delete(str(user_id))
+
+
 CurrentUserDep = Annotated[User, Depends(get_current_user)]
+
+
+async def get_read_session(
+    principal: OptionalPrincipalDep, session: SessionDep
+) -> AsyncGenerator[AsyncSession]:
+    # Signed in callers may be reading their own writes, which a lagging
+    # replica might not have yet, so only anonymous reads leave the primary.
+    # The primary session is lazy and never connects if it goes unused
+    replica = None if principal else await read_replicas.engine()
+    if replica is None:
+        yield session
+        return
+    async with AsyncSession(replica, expire_on_commit=False) as replica_session:
+        yield replica_session
+
+
+# For handlers that only read, never mix it with SessionDep writes
+ReadSessionDep = Annotated[AsyncSession, Depends(get_read_session)]
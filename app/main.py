@@ -1,13 +1,44 @@
+import asyncio
+import logging
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
 from typing import Any
 
-from fastapi import FastAPI, status
+from fastapi import FastAPI, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import config
-from app.deps import SessionDep
+from app.core.db import engine, replica_engines
+from app.core.metrics import mark_process_dead, monitor_event_loop_lag
+from app.core.middleware import MetricsMiddleware, QueryStatsMiddleware
+from app.core.pagination import NEXT_CURSOR_HEADER
+from app.deps import database_probe, jobs
 from app.routers import auth, posts, votes
+from app.routers.votes import vote_buffer
+from app.trending import refresh_post_scores_periodically
 
-app = FastAPI(title="Social Media API", version="1.0.0")
+logging.basicConfig(format="%(levelname)s:  %(name)s %(message)s")
+logging.getLogger("app").setLevel(config.log_level)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncGenerator[None]:
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    jobs.start()
+    trending_refresher = asyncio.create_task(refresh_post_scores_periodically(engine))
+    yield
+    lag_monitor.cancel()
+    trending_refresher.cancel()
+    await vote_buffer.close()
+    # Before the engines go, queued jobs may still need them
+    await jobs.drain(config.job_drain_timeout_seconds)
+    await engine.dispose()
+    for replica_engine in replica_engines:
+        await replica_engine.dispose()
+    mark_process_dead()
+
+
+app = FastAPI(title="Social Media API", version="1.0.0", lifespan=lifespan)
 
 # Set all CORS enabled origins
 if config.all_cors_origins:
@@ -17,8 +48,11 @@ if config.all_cors_origins:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER],
     )
 
+app.add_middleware(QueryStatsMiddleware)  # ty:ignore[invalid-argument-type]
+app.add_middleware(MetricsMiddleware)  # ty:ignore[invalid-argument-type]
 
 app.include_router(auth.router)
 app.include_router(posts.router)
@@ -26,11 +60,30 @@ app.include_router(votes.router)
 
 
 @app.get(
-    "/health",
+    "/health/live",
+    tags=["status"],
+    summary="Check the Process Is Serving",
+    status_code=status.HTTP_200_OK,
+    response_model=dict[str, str],
+)
+@app.get("/health", include_in_schema=False)
+async def read_health() -> Any:
+    # Touches nothing, so it stays fast even when the pool is exhausted
+    return {"status": "ok"}
+
+
+@app.get(
+    "/health/ready",
     tags=["status"],
-    summary="Perform a Health Check",
+    summary="Check the Database Is Reachable",
     status_code=status.HTTP_200_OK,
     response_model=dict[str, str],
+    responses={status.HTTP_503_SERVICE_UNAVAILABLE: {"description": "Not Ready"}},
 )
-async def read_health(*, _session: SessionDep) -> Any:
+async def read_readiness() -> Any:
+    if not await database_probe.is_ready():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database unavailable",
+        )
     return {"status": "ok"}
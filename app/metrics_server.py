@@ -0,0 +1,7 @@
+# Serves every uvicorn worker's metrics on METRICS_PORT, apart from the public
+# port, see entrypoint.sh
+from app.core.config import config
+from app.core.metrics import serve_metrics
+
+if __name__ == "__main__":
+    serve_metrics(config.metrics_port)
@@ -1,8 +1,11 @@
 import uuid
 from datetime import UTC, datetime
+from typing import Any, Literal
 
 from pydantic import EmailStr
-from sqlmodel import Field, Relationship, SQLModel
+from sqlalchemy import Column, Computed
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlmodel import Field, Index, Relationship, SQLModel
 
 
 # Generic message
@@ -16,9 +19,11 @@ class UserBase(SQLModel):
 
 
 class User(UserBase, table=True):
-    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True, index=True)
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
 
     hashed_password: str
+    # Embedded in access tokens, bumping it revokes every token issued before
+    token_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
     created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
     updated_at: datetime = Field(
@@ -46,13 +51,23 @@ class Token(SQLModel):
 
 
 class PostBase(SQLModel):
-    title: str = Field(index=True)
+    title: str
     content: str
     published: bool = Field(default=True)
 
 
 class Post(PostBase, table=True):
-    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True, index=True)
+    # Keyset pagination of the feed seeks on (created_at, id), within
+    # published posts when the feed is filtered on them
+    __table_args__ = (
+        Index("ix_post_created_at_id", "created_at", "id"),
+        Index("ix_post_published_created_at_id", "published", "created_at", "id"),
+    )
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+
+    # Denormalized count of rows in `vote`, maintained by the votes router
+    vote_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
     created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
     updated_at: datetime = Field(
@@ -60,10 +75,26 @@ class Post(PostBase, table=True):
         sa_column_kwargs={"onupdate": lambda: datetime.now(UTC)},
     )
 
-    owner_id: uuid.UUID = Field(foreign_key="user.id", ondelete="CASCADE")
+    # Indexed so deleting a user doesn't scan every post for the cascade
+    owner_id: uuid.UUID = Field(foreign_key="user.id", ondelete="CASCADE", index=True)
     owner: User = Relationship(back_populates="posts")
 
 
+# Weighted full-text document over title and content. It lives on the table
+# but not on the mapped model, so plain post reads never load it.
+post_search_vector = Column(
+    "search_vector",
+    TSVECTOR,
+    Computed(
+        "setweight(to_tsvector('english', title), 'A') || "
+        "setweight(to_tsvector('english', content), 'B')",
+        persisted=True,
+    ),
+)
+Post.__table__.append_column(post_search_vector)
+Index("ix_post_search_vector", post_search_vector, postgresql_using="gin")
+
+
 class PostCreate(PostBase):
     pass
 
@@ -80,6 +111,24 @@ class PostPublic(PostBase):
 class PostPublicWithVotes(SQLModel):
     Post: PostPublic
     votes: int
+    # Only known when the request carries an access token
+    voted_by_me: bool | None = None
+
+
+class BulkPostError(SQLModel):
+    index: int
+    detail: list[dict[str, Any]]
+
+
+class BulkPostResult(SQLModel):
+    created: int
+    ids: list[uuid.UUID]
+    errors: list[BulkPostError]
+
+
+# Flat row for bulk exports, one per line
+class PostExport(PostPublic):
+    vote_count: int
 
 
 class PostUpdate(SQLModel):
@@ -87,14 +136,46 @@ class PostUpdate(SQLModel):
 
 
 class Vote(SQLModel, table=True):
+    # The primary key leads with user_id, lookups by post need their own index
     user_id: uuid.UUID = Field(
         foreign_key="user.id", ondelete="CASCADE", primary_key=True
     )
+    post_id: uuid.UUID = Field(
+        foreign_key="post.id", ondelete="CASCADE", primary_key=True, index=True
+    )
+
+
+class PostScore(SQLModel, table=True):
+    # Trending rank of a recent post, see app.trending
+    __table_args__ = (Index("ix_postscore_score_post_id", "score", "post_id"),)
+
     post_id: uuid.UUID = Field(
         foreign_key="post.id", ondelete="CASCADE", primary_key=True
     )
+    score: float
+    # Copied from the post, to tell when it needs scoring again or has aged out
+    vote_count: int
+    created_at: datetime
+
+
+class Job(SQLModel, table=True):
+    # Durable background job, see app.core.jobs. Workers claim due jobs in
+    # (run_after, id) order
+    __table_args__ = (Index("ix_job_run_after_id", "run_after", "id"),)
+
+    id: int | None = Field(default=None, primary_key=True)
+    name: str
+    args: list[Any] = Field(sa_column=Column(JSONB, nullable=False))
+    attempts: int = 0
+    run_after: datetime = Field(default_factory=lambda: datetime.now(UTC))
 
 
 class VoteCreate(SQLModel):
     post_id: uuid.UUID
     dir: int = Field(ge=0, le=1)
+
+
+class VoteResult(SQLModel):
+    post_id: uuid.UUID
+    dir: int
+    status: Literal["added", "removed", "unchanged", "not_found"]
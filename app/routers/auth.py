@@ -2,53 +2,107 @@ from typing import Annotated, Any
 
 from fastapi import APIRouter, Body, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlmodel import select
+from sqlmodel import col, select, update
 
-from app.core.security import create_access_token, hash_password, verify_password
-from app.deps import CurrentUserDep, SessionDep
-from app.models import Token, User, UserCreate, UserPublic
+from app.core.security import create_access_token, password_hash_pool
+from app.deps import (
+    CurrentUserDep,
+    PrincipalDep,
+    SessionDep,
+    invalidate_user,
+    limit_auth_concurrency,
+    token_revocations,
+)
+from app.models import Message, Token, User, UserCreate, UserPublic
 
 router = APIRouter(tags=["auth"])
 
 
 @router.post(
-    "/register", status_code=status.HTTP_201_CREATED, response_model=UserPublic
+    "/register",
+    status_code=status.HTTP_201_CREATED,
+    response_model=UserPublic,
+    dependencies=[Depends(limit_auth_concurrency)],
 )
 async def register_user(
     *, session: SessionDep, user: Annotated[UserCreate, Body()]
 ) -> Any:
-    db_user = session.exec(select(User).where(User.username == user.username)).first()
+    db_user = (
+        await session.exec(select(User).where(User.username == user.username))
+    ).first()
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered",
         )
-    hashed_password = hash_password(user.password)
+    hashed_password = await password_hash_pool.hash(user.password)
     user_dict = user.model_dump()
     new_user = User.model_validate(
         user_dict, update={"hashed_password": hashed_password}
     )
     session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
+    await session.commit()
+    await session.refresh(new_user)
     return new_user
 
 
-@router.post("/token", status_code=status.HTTP_200_OK, response_model=Token)
+@router.post(
+    "/token",
+    status_code=status.HTTP_200_OK,
+    response_model=Token,
+    dependencies=[Depends(limit_auth_concurrency)],
+)
 async def login_for_access_token(
     *, session: SessionDep, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
 ) -> Token:
-    user = session.exec(select(User).where(User.username == form_data.username)).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = (
+        await session.exec(select(User).where(User.username == form_data.username))
+    ).first()
+    if not user or not await password_hash_pool.verify(
+        form_data.password, user.hashed_password
+    ):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": user.username})
+    access_token = create_access_token(
+        data={"sub": str(user.id), "ver": user.token_version}
+    )
     return Token(access_token=access_token, token_type="bearer")
 
 
 @router.get("/users/me", response_model=UserPublic)
 async def read_users_me(*, current_user: CurrentUserDep) -> Any:
     return current_user
+
+
+@router.post("/logout", status_code=status.HTTP_200_OK, response_model=Message)
+async def logout(*, principal: PrincipalDep) -> Message:
+    await token_revocations.revoke(principal)
+    return Message(message="Logged out")
+
+
+@router.post("/logout/all", status_code=status.HTTP_200_OK, response_model=Message)
+async def logout_everywhere(
+    *, session: SessionDep, current_user: CurrentUserDep
+) -> Message:
+    # Bumped in the database, the cached user may be stale and two logouts may
+    # run at once
+    token_version = await session.scalar(
+        update(User)
+        .where(col(User.id) == current_user.id)
+        .values(token_version=col(User.token_version) + 1)
+        .returning(col(User.token_version))
+    )
+    await session.commit()
+    if token_version is None:
+        # Deleted since its token was checked
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    await token_revocations.revoke_before(current_user.id, token_version)
+    await invalidate_user(current_user.id)
+    return Message(message="Logged out of every session")
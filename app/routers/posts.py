@@ -1,100 +1,458 @@
+import csv
+import io
 import uuid
-from typing import Annotated, Any
+from collections.abc import AsyncGenerator, Sequence
+from datetime import UTC, datetime
+from typing import Annotated, Any, Literal
 
-from fastapi import APIRouter, Body, HTTPException, Path, Query, status
-from sqlmodel import col, func, select
+from fastapi import (
+    APIRouter,
+    Body,
+    Header,
+    HTTPException,
+    Path,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import ColumnElement, Row, Select, exists
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+from sqlmodel import col, func, insert, select, tuple_
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.deps import CurrentUserDep, SessionDep
+from app.core.config import config
+from app.core.http import content_etag, etag_matches, make_etag
+from app.core.pagination import (
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    decode_cursor,
+    encode_cursor,
+)
+from app.core.serialization import JSONBody
+from app.deps import (
+    OptionalPrincipalDep,
+    PrincipalDep,
+    ReadSessionDep,
+    SessionDep,
+    feed_cache,
+    jobs,
+    refuse_deleted_user,
+)
 from app.models import (
+    BulkPostError,
+    BulkPostResult,
     Post,
     PostCreate,
+    PostExport,
     PostPublic,
     PostPublicWithVotes,
+    PostScore,
     PostUpdate,
     Vote,
+    post_search_vector,
 )
+from app.trending import window_start
 
 router = APIRouter(prefix="/posts", tags=["posts"])
 
+feed_body = JSONBody(list[PostPublicWithVotes])
+post_body = JSONBody(PostPublicWithVotes)
+export_row = JSONBody(PostExport)
+post_create = TypeAdapter(PostCreate)
+bulk_array = TypeAdapter(list[Any])
+
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=PostPublic)
 async def create_post(
     *,
     session: SessionDep,
-    current_user: CurrentUserDep,
+    principal: PrincipalDep,
     post: Annotated[PostCreate, Body()],
 ) -> Any:
-    db_post = Post.model_validate(post, update={"owner_id": current_user.id})
+    db_post = Post.model_validate(post, update={"owner_id": principal.id})
     session.add(db_post)
-    session.commit()
-    session.refresh(db_post)
+    with refuse_deleted_user():
+        await session.commit()
+    await session.refresh(db_post)
+    await jobs.enqueue(feed_cache.invalidate)
     return db_post
 
 
-@router.get("/", response_model=list[PostPublicWithVotes])
+BULK_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {
+                "schema": {
+                    "type": "array",
+                    "items": {"$ref": "#/components/schemas/PostCreate"},
+                }
+            },
+            "application/x-ndjson": {
+                "schema": {"$ref": "#/components/schemas/PostCreate"}
+            },
+        },
+    }
+}
+
+
+async def _bulk_items(request: Request) -> AsyncGenerator[Any]:
+    """Yield raw items from a JSON array or, line by line, from NDJSON."""
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("application/x-ndjson"):
+        try:
+            items = bulk_array.validate_json(await request.body())
+        except ValidationError:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+                detail="Expected a JSON array of posts",
+            )
+        for item in items:
+            yield item
+        return
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+@router.post(
+    "/bulk",
+    status_code=status.HTTP_200_OK,
+    response_model=BulkPostResult,
+    openapi_extra=BULK_OPENAPI,
+)
+async def create_posts(
+    *, session: SessionDep, principal: PrincipalDep, request: Request
+) -> Any:
+    result = BulkPostResult(created=0, ids=[], errors=[])
+    rows: list[dict[str, Any]] = []
+    index = 0
+    async for item in _bulk_items(request):
+        if index >= config.bulk_create_max_items:
+            raise HTTPException(
+                status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                detail=f"At most {config.bulk_create_max_items} posts per request",
+            )
+        try:
+            if isinstance(item, bytes):
+                post = post_create.validate_json(item)
+            else:
+                post = post_create.validate_python(item)
+        except ValidationError as e:
+            detail = e.errors(include_url=False, include_context=False)
+            result.errors.append(BulkPostError(index=index, detail=detail))
+        else:
+            # Ids are made here, so the INSERT doesn't need to return them
+            post_id = uuid.uuid4()
+            now = datetime.now(UTC)
+            rows.append(
+                post.model_dump()
+                | {
+                    "id": post_id,
+                    "owner_id": principal.id,
+                    "created_at": now,
+                    "updated_at": now,
+                }
+            )
+            result.ids.append(post_id)
+        index += 1
+        if len(rows) >= config.bulk_create_chunk_size:
+            # One multi-row INSERT per chunk instead of a round trip per post
+            with refuse_deleted_user():
+                await session.exec(insert(Post).values(rows))
+            rows.clear()
+    if rows:
+        with refuse_deleted_user():
+            await session.exec(insert(Post).values(rows))
+    # All or nothing for the valid posts, a 413 above rolls back what was sent
+    await session.commit()
+    result.created = len(result.ids)
+    if result.created:
+        await jobs.enqueue(feed_cache.invalidate)
+    return result
+
+
+def _search_query(search: str) -> ColumnElement[Any]:
+    return func.websearch_to_tsquery("english", search)
+
+
+def _filter_posts[Q: Select[Any]](
+    query: Q, *, published: bool | None, search: str | None
+) -> Q:
+    if published:
+        query = query.where(Post.published == published)
+    if search:
+        # Served by the GIN index on post.search_vector
+        query = query.where(post_search_vector.op("@@")(_search_query(search)))
+    return query
+
+
+def _voted_by(user_id: uuid.UUID) -> ColumnElement[bool]:
+    # Correlated on each returned post and answered from the vote primary key,
+    # within the same statement rather than a lookup per post
+    return (
+        exists()
+        .where(col(Vote.user_id) == user_id, col(Vote.post_id) == Post.id)
+        .label("voted_by_me")
+    )
+
+
+async def _read_posts_page(
+    session: AsyncSession,
+    *,
+    offset: int,
+    limit: int,
+    cursor: str | None,
+    published: bool | None,
+    search: str | None,
+    voter_id: uuid.UUID | None,
+) -> tuple[Sequence[Row[Any]], str | None]:
+    query = _filter_posts(
+        select(Post, col(Post.vote_count).label("votes")),
+        published=published,
+        search=search,
+    )
+    if voter_id is not None:
+        query = query.add_columns(_voted_by(voter_id))
+    sort_keys = [col(Post.created_at), col(Post.id)]
+    if search:
+        # Best matches first. The rank is a float4, widened so the value the
+        # cursor carries back compares equal to it
+        rank = func.ts_rank_cd(post_search_vector, _search_query(search)).cast(
+            DOUBLE_PRECISION
+        )
+        query = query.add_columns(rank.label("rank"))
+        sort_keys.insert(0, rank)
+    query = query.order_by(*(key.desc() for key in sort_keys))
+    if cursor:
+        try:
+            created_at, post_id, last_rank = decode_cursor(cursor)
+            if (last_rank is not None) != bool(search):
+                raise ValueError("Cursor belongs to a different query")
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+            )
+        last_keys = (created_at, post_id)
+        if last_rank is not None:
+            last_keys = (last_rank, *last_keys)
+        # Seek past the previous page instead of counting rows off
+        query = query.where(tuple_(*sort_keys) < last_keys)
+    else:
+        query = query.offset(offset)
+    # Fetch one extra row to learn whether another page follows
+    results = (await session.exec(query.limit(limit + 1))).all()
+    if len(results) <= limit:
+        return results, None
+    results = results[:limit]
+    last = results[-1]
+    next_cursor = encode_cursor(
+        last.Post.created_at, last.Post.id, last.rank if search else None
+    )
+    return results, next_cursor
+
+
+@router.get(
+    "/",
+    response_model=list[PostPublicWithVotes],
+    responses={status.HTTP_304_NOT_MODIFIED: {"description": "Not Modified"}},
+)
 async def read_posts(
     *,
-    session: SessionDep,
-    offset: Annotated[int, Query(ge=0)] = 0,
-    limit: Annotated[int, Query(gt=0)] = 100,
+    session: ReadSessionDep,
+    principal: OptionalPrincipalDep,
+    offset: Annotated[
+        int, Query(ge=0, description="Deprecated, page with `cursor` instead")
+    ] = 0,
+    limit: Annotated[int, Query(gt=0, le=MAX_PAGE_SIZE)] = MAX_PAGE_SIZE,
+    cursor: Annotated[
+        str | None,
+        Query(description=f"Opaque `{NEXT_CURSOR_HEADER}` of the previous page"),
+    ] = None,
+    published: Annotated[bool | None, Query()] = None,
+    search: Annotated[str | None, Query()] = None,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> Any:
+    # The anonymous feed is the same for every caller, so key pages by their
+    # parameters. Signed in callers see their own votes and skip the cache
+    cache_key = repr((offset, limit, cursor, published, search))
+    page, generation = None, None
+    if not principal:
+        # Read before the query, a write during it must not file a stale page
+        # under the generation that write started
+        page, generation = await feed_cache.get(cache_key)
+    if page is None:
+        results, next_cursor = await _read_posts_page(
+            session,
+            offset=offset,
+            limit=limit,
+            cursor=cursor,
+            published=published,
+            search=search,
+            voter_id=principal.id if principal else None,
+        )
+        content = feed_body.dump(results)
+        page = (content, content_etag(content), next_cursor)
+        if generation is not None:
+            await feed_cache.set(cache_key, page, generation)
+    content, etag, next_cursor = page
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache"
+        if principal
+        else f"public, max-age={config.feed_cache_ttl_seconds}",
+        "Vary": "Authorization",
+    }
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+async def _export_posts(
+    session: AsyncSession, query: Select[Any], format: str
+) -> AsyncGenerator[bytes]:
+    # A server-side cursor hands rows over a batch at a time, so memory stays
+    # flat however many posts match
+    result = await session.stream(
+        query.execution_options(yield_per=config.export_batch_size)
+    )
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(PostExport.model_fields))
+
+        def take() -> bytes:
+            written = buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            return written
+
+        writer.writeheader()
+        # Sent on its own, so an export that matches nothing still has it
+        yield take()
+        async for rows in result.partitions():
+            writer.writerows(export_row.dump_python(row) for row in rows)
+            yield take()
+    else:
+        async for rows in result.partitions():
+            yield export_row.dump_lines(rows)
+
+
+@router.get(
+    "/export",
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            "content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()},
+            "description": "One post per line, oldest first",
+        }
+    },
+)
+async def export_posts(
+    *,
+    session: ReadSessionDep,
+    format: Annotated[Literal["ndjson", "csv"], Query()] = "ndjson",
     published: Annotated[bool | None, Query()] = None,
     search: Annotated[str | None, Query()] = None,
+) -> StreamingResponse:
+    columns = [Post.__table__.c[name] for name in PostExport.model_fields]
+    query = _filter_posts(
+        select(*columns), published=published, search=search
+    ).order_by(col(Post.created_at), col(Post.id))
+    return StreamingResponse(
+        _export_posts(session, query, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="posts.{format}"'},
+    )
+
+
+@router.get("/trending", response_model=list[PostPublicWithVotes])
+async def read_trending_posts(
+    *,
+    session: ReadSessionDep,
+    principal: OptionalPrincipalDep,
+    limit: Annotated[int, Query(gt=0, le=MAX_PAGE_SIZE)] = MAX_PAGE_SIZE,
 ) -> Any:
+    # Reads the top of ix_postscore_score_post_id, scores are kept current by
+    # the refresher in app.trending
     query = (
-        select(Post, func.count(Vote.post_id).label("votes"))
-        .join(Vote, Vote.post_id == Post.id, isouter=True)
-        .group_by(Post.id)
+        select(Post, col(Post.vote_count).label("votes"))
+        .join(PostScore, col(PostScore.post_id) == Post.id)
+        .where(col(Post.published), col(PostScore.created_at) >= window_start())
+        .order_by(col(PostScore.score).desc(), col(PostScore.post_id).desc())
+        .limit(limit)
     )
-    if published:
-        query = query.where(Post.published == published)
-    if search:
-        query = query.where(col(Post.title).icontains(search))
-    results = session.exec(query.offset(offset).limit(limit)).all()
-    return results
+    if principal:
+        query = query.add_columns(_voted_by(principal.id))
+    results = (await session.exec(query)).all()
+    return feed_body.response(results)
 
 
-@router.get("/{post_id}", response_model=PostPublicWithVotes)
+@router.get(
+    "/{post_id}",
+    response_model=PostPublicWithVotes,
+    responses={status.HTTP_304_NOT_MODIFIED: {"description": "Not Modified"}},
+)
 async def read_post(
     *,
-    session: SessionDep,
+    session: ReadSessionDep,
+    principal: OptionalPrincipalDep,
     post_id: Annotated[uuid.UUID, Path()],
+    if_none_match: Annotated[str | None, Header()] = None,
 ) -> Any:
-    post = session.get(Post, post_id)
-    if not post:
+    query = select(Post, col(Post.vote_count).label("votes")).where(Post.id == post_id)
+    if principal:
+        query = query.add_columns(_voted_by(principal.id))
+    result = (await session.exec(query)).first()
+    if not result:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Post not found"
         )
-    results = session.exec(
-        select(Post, func.count(Vote.post_id).label("votes"))
-        .join(Vote, Vote.post_id == Post.id, isouter=True)
-        .where(Post.id == post_id)
-        .group_by(Post.id)
-    ).first()
-    return results
+    post, votes, *voted_by_me = result
+    # Edits bump updated_at and votes bump the count, together they version a post
+    etag = make_etag(post.updated_at.isoformat(), votes, *voted_by_me)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Authorization"}
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return post_body.response(result, headers=headers)
 
 
 @router.put("/{post_id}", response_model=PostPublic)
 async def update_post(
     *,
     session: SessionDep,
-    current_user: CurrentUserDep,
+    principal: PrincipalDep,
     post_id: Annotated[uuid.UUID, Path()],
     post: Annotated[PostUpdate, Body()],
 ) -> Any:
-    db_post = session.get(Post, post_id)
+    db_post = await session.get(Post, post_id)
     if not db_post:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Post not found"
         )
-    if db_post.owner_id != current_user.id:
+    if db_post.owner_id != principal.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Not enough premissions"
         )
     update_dict = post.model_dump(exclude_unset=True)
     db_post.sqlmodel_update(update_dict)
     session.add(db_post)
-    session.commit()
-    session.refresh(db_post)
+    await session.commit()
+    await session.refresh(db_post)
+    await jobs.enqueue(feed_cache.invalidate)
     return db_post
 
 
@@ -102,18 +460,19 @@ async def update_post(
 async def delete_post(
     *,
     session: SessionDep,
-    current_user: CurrentUserDep,
+    principal: PrincipalDep,
     post_id: Annotated[uuid.UUID, Path()],
 ) -> None:
-    post = session.get(Post, post_id)
+    post = await session.get(Post, post_id)
     if not post:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Post not found"
         )
-    if post.owner_id != current_user.id:
+    if post.owner_id != principal.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Not enough premissions"
         )
-    session.delete(post)
-    session.commit()
+    await session.delete(post)
+    await session.commit()
+    await jobs.enqueue(feed_cache.invalidate)
     return None
@@ -1,45 +1,241 @@
-from typing import Annotated
+import uuid
+from collections.abc import Mapping, Sequence
+from typing import Annotated, Any
 
-from fastapi import APIRouter, Body, HTTPException, status
+from fastapi import APIRouter, Body, HTTPException, Response, status
+from sqlalchemy import ARRAY, TableValuedAlias, Uuid, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import col, delete, func, literal, select, tuple_, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.deps import CurrentUserDep, SessionDep
-from app.models import Message, Post, Vote, VoteCreate
+from app.core.buffer import WriteBuffer
+from app.core.config import config
+from app.core.db import engine
+from app.core.serialization import JSONBody
+from app.deps import (
+    PrincipalDep,
+    SessionDep,
+    feed_cache,
+    jobs,
+    refuse_deleted_user,
+)
+from app.models import Message, Post, User, Vote, VoteCreate, VoteResult
 
 router = APIRouter(prefix="/votes", tags=["votes"])
 
+vote_results_body = JSONBody(list[VoteResult])
+
+
+type VoteKey = tuple[uuid.UUID, uuid.UUID]
+
+
+def _unnest_votes(keys: Sequence[VoteKey], name: str) -> TableValuedAlias:
+    # Two arrays bound as parameters, so the statement is the same for any
+    # number of votes, none included
+    return (
+        func.unnest(
+            literal([user_id for user_id, _ in keys], ARRAY(Uuid)),
+            literal([post_id for _, post_id in keys], ARRAY(Uuid)),
+        )
+        .table_valued("user_id", "post_id", name=name)
+        .render_derived()
+    )
+
+
+async def write_votes(
+    session: AsyncSession,
+    intents: Mapping[VoteKey, int],
+    *,
+    skip_unknown_users: bool = False,
+) -> dict[VoteKey, bool | None]:
+    """Apply vote intents of any users and their count changes in one statement.
+
+    Returns for each (user_id, post_id) whether the vote changed, or None when
+    the post doesn't exist. Inserts skip existing votes through ON CONFLICT
+    instead of checking first, so concurrent votes can't race. Votes of users
+    that don't exist fail the statement on the foreign key, unless
+    `skip_unknown_users` is set, then they are left unchanged. Doesn't commit.
+    """
+    keys = list(intents)
+    requested = _unnest_votes(keys, "requested")
+    adding = _unnest_votes([key for key in keys if intents[key] == 1], "adding")
+    removing = _unnest_votes([key for key in keys if intents[key] == 0], "removing")
+    # Lock the posts in id order before counting, so batches of different
+    # workers touching the same posts queue up instead of deadlocking. Same
+    # lock as the count UPDATE takes, so new votes' foreign keys aren't blocked
+    locked = (
+        select(col(Post.id))
+        .where(col(Post.id).in_(select(requested.c.post_id)))
+        .order_by(col(Post.id))
+        .with_for_update(key_share=True)
+        .cte("locked")
+    )
+    voted = select(adding.c.user_id, locked.c.id).join(
+        locked, locked.c.id == adding.c.post_id
+    )
+    if skip_unknown_users:
+        voted = voted.join(User, col(User.id) == adding.c.user_id)
+    added = (
+        insert(Vote)
+        .from_select(["user_id", "post_id"], voted)
+        .on_conflict_do_nothing()
+        .returning(col(Vote.user_id), col(Vote.post_id))
+        .cte("added")
+    )
+    removed = (
+        delete(Vote)
+        .where(
+            tuple_(col(Vote.user_id), col(Vote.post_id)).in_(
+                select(removing.c.user_id, removing.c.post_id)
+            )
+        )
+        .returning(col(Vote.user_id), col(Vote.post_id))
+        .cte("removed")
+    )
+    changes = union_all(
+        select(added.c.post_id, literal(1).label("delta")),
+        select(removed.c.post_id, literal(-1).label("delta")),
+    ).subquery("changes")
+    deltas = (
+        select(changes.c.post_id, func.sum(changes.c.delta).label("delta"))
+        .group_by(changes.c.post_id)
+        .subquery("deltas")
+    )
+    # One UPDATE per post however many votes it gained or lost, as a row can
+    # only be updated once per statement. Votes aren't edits of the post, so
+    # keep `updated_at` from bumping
+    counts = (
+        update(Post)
+        .where(col(Post.id) == deltas.c.post_id)
+        .values(
+            vote_count=col(Post.vote_count) + deltas.c.delta,
+            updated_at=Post.updated_at,
+        )
+        .returning(col(Post.id))
+        .cte("counts")
+    )
+    statement = (
+        select(
+            requested.c.user_id,
+            requested.c.post_id,
+            locked.c.id.is_not(None),
+            tuple_(requested.c.user_id, requested.c.post_id).in_(
+                union_all(
+                    select(added.c.user_id, added.c.post_id),
+                    select(removed.c.user_id, removed.c.post_id),
+                )
+            ),
+        )
+        .outerjoin(locked, locked.c.id == requested.c.post_id)
+        .add_cte(counts)
+    )
+    return {
+        (user_id, post_id): changed if found else None
+        for user_id, post_id, found, changed in (await session.exec(statement)).all()
+    }
+
+
+async def apply_votes(
+    session: AsyncSession, user_id: uuid.UUID, votes: Sequence[VoteCreate]
+) -> list[VoteResult]:
+    """Apply one user's vote intents, later intents for the same post win."""
+    intents = {(user_id, vote.post_id): vote.dir for vote in votes}
+    with refuse_deleted_user():
+        changes = await write_votes(session, intents)
+    await session.commit()
+    if any(changes.values()):
+        await jobs.enqueue(feed_cache.invalidate)
+    results = []
+    for (_, post_id), dir in intents.items():
+        changed = changes.get((user_id, post_id))
+        if changed is None:
+            vote_status = "not_found"
+        elif changed:
+            vote_status = "added" if dir == 1 else "removed"
+        else:
+            vote_status = "unchanged"
+        results.append(VoteResult(post_id=post_id, dir=dir, status=vote_status))
+    return results
+
+
+async def flush_votes(
+    intents: dict[VoteKey, int], *, engine: AsyncEngine = engine
+) -> None:
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        # A batch mixes many users, one deleted user mustn't fail it for all
+        changes = await write_votes(session, intents, skip_unknown_users=True)
+        # One commit, and so one WAL flush, for the whole batch
+        await session.commit()
+    if any(changes.values()):
+        await jobs.enqueue(feed_cache.invalidate)
+
+
+# Collects single votes when VOTE_BUFFER_ENABLED is set, see WriteBuffer
+vote_buffer: WriteBuffer[VoteKey, int] = WriteBuffer(
+    flush_votes,
+    max_items=config.vote_buffer_max_items,
+    max_delay=config.vote_buffer_max_delay_ms / 1000,
+    max_attempts=config.vote_buffer_max_attempts,
+    retry_delay=config.vote_buffer_retry_delay_ms / 1000,
+)
+
 
 # TODO: replace response_model with PostPublicWithVotes
-@router.post("/", status_code=status.HTTP_200_OK, response_model=Message)
-def add_or_remove_vote(
+@router.post(
+    "/",
+    status_code=status.HTTP_200_OK,
+    response_model=Message,
+    responses={
+        status.HTTP_202_ACCEPTED: {
+            "model": Message,
+            "description": "Buffered, to be written within VOTE_BUFFER_MAX_DELAY_MS",
+        }
+    },
+)
+async def add_or_remove_vote(
     *,
     session: SessionDep,
-    current_user: CurrentUserDep,
+    principal: PrincipalDep,
     vote: Annotated[VoteCreate, Body()],
+    response: Response,
 ) -> Message:
-    post = session.get(Post, vote.post_id)
-    if not post:
+    if config.vote_buffer_enabled:
+        # Unknown posts and repeated votes are skipped when the buffer flushes
+        vote_buffer.add((principal.id, vote.post_id), vote.dir)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return Message(message="vote accepted")
+    (result,) = await apply_votes(session, principal.id, [vote])
+    if result.status == "not_found":
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Post not found"
         )
-    db_vote = session.get(Vote, (current_user.id, vote.post_id))
     if vote.dir == 1:
         # If the vote direction is 1, we add (create) a vote
-        if db_vote:
+        if result.status == "unchanged":
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail="Post has vote by current user",
             )
-        new_vote = Vote(user_id=current_user.id, post_id=vote.post_id)
-        session.add(new_vote)
-        session.commit()
         return Message(message="successfully added vote")
     else:
         # If the vote direction is 0, we remove (delete) a vote
-        if not db_vote:
+        if result.status == "unchanged":
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail="Vote not found",
             )
-        session.delete(db_vote)
-        session.commit()
         return Message(message="successfully deleted vote")
+
+
+@router.post("/batch", status_code=status.HTTP_200_OK, response_model=list[VoteResult])
+async def add_or_remove_votes(
+    *,
+    session: SessionDep,
+    principal: PrincipalDep,
+    votes: Annotated[
+        list[VoteCreate], Body(min_length=1, max_length=config.vote_batch_max_items)
+    ],
+) -> Any:
+    results = await apply_votes(session, principal.id, votes)
+    return vote_results_body.response(results)
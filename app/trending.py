@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import math
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from sqlalchemy import ColumnElement, exc
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import col, delete, func, or_, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import config
+from app.models import Post, PostScore
+
+logger = logging.getLogger(__name__)
+
+# Taken for the length of a refresh, so only one worker runs it at a time
+REFRESH_LOCK_ID = 0x7472656E64
+
+
+def hot_score(votes: Any, created_at: Any) -> ColumnElement[float]:
+    # log2(1 + votes) plus the creation time in half-lives ranks posts the same
+    # as (1 + votes) * 2^(-age / half-life), but it doesn't change as posts age.
+    # So a score only needs recomputing when the post's votes change
+    half_life = config.trending_half_life_hours * 3600
+    return func.ln(1 + votes) / math.log(2) + (
+        func.extract("epoch", created_at) / half_life
+    )
+
+
+def window_start() -> datetime:
+    return datetime.now(UTC) - timedelta(hours=config.trending_window_hours)
+
+
+async def refresh_post_scores(session: AsyncSession) -> int:
+    """Score new posts and posts whose votes changed, drop those past the window.
+
+    Returns how many scores were written, or -1 when another worker holds the
+    refresh.
+    """
+    locked = await session.scalar(
+        select(func.pg_try_advisory_xact_lock(REFRESH_LOCK_ID))
+    )
+    if not locked:
+        return -1
+    start = window_start()
+    changed = (
+        select(
+            col(Post.id),
+            col(Post.vote_count),
+            col(Post.created_at),
+            hot_score(Post.vote_count, Post.created_at),
+        )
+        .outerjoin(PostScore, col(PostScore.post_id) == Post.id)
+        .where(
+            col(Post.created_at) >= start,
+            or_(
+                col(PostScore.post_id).is_(None),
+                col(PostScore.vote_count) != Post.vote_count,
+            ),
+        )
+    )
+    upsert = insert(PostScore).from_select(
+        ["post_id", "vote_count", "created_at", "score"], changed
+    )
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[col(PostScore.post_id)],
+        set_={"vote_count": upsert.excluded.vote_count, "score": upsert.excluded.score},
+    ).returning(col(PostScore.post_id))
+    written = len((await session.exec(upsert)).all())
+    await session.exec(delete(PostScore).where(col(PostScore.created_at) < start))
+    await session.commit()
+    return written
+
+
+async def refresh_post_scores_periodically(engine: AsyncEngine) -> None:
+    # Scores persist across restarts, so the first refresh can wait its turn
+    while True:
+        await asyncio.sleep(config.trending_refresh_seconds)
+        try:
+            async with AsyncSession(engine, expire_on_commit=False) as session:
+                written = await refresh_post_scores(session)
+            logger.debug("refreshed post scores written=%d", written)
+        except exc.SQLAlchemyError:
+            logger.exception("refreshing post scores failed")
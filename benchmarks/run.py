@@ -0,0 +1,386 @@
+"""Seed a database, serve the app with uvicorn and measure every route.
+
+    python -m benchmarks.run --output results.json
+
+Results are JSON so runs on different commits can be diffed or plotted.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from datetime import UTC, datetime
+from typing import Any
+
+import httpx
+from alembic.config import Config, command
+from sqlalchemy import Engine, text
+from sqlmodel import create_engine
+
+from app.core.security import create_access_token
+from benchmarks.seed import PASSWORD, WORDS, SeededData, seed
+
+type RequestFactory = Callable[[random.Random], dict[str, Any]]
+
+
+@dataclass
+class Scenario:
+    name: str
+    make_request: RequestFactory
+    requests: int
+    # Posts or votes carried by each request, for batch routes
+    items_per_request: int = 1
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    requests: int
+    errors: int
+    statuses: dict[int, int]
+    seconds: float
+    throughput: float
+    items_per_second: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    queries_per_request: float
+    # Transactions that wrote, each one a WAL flush on commit
+    write_transactions: int
+    commits_per_second: float
+
+
+BULK_SIZE = 100
+# Long enough for buffered writes to be flushed, see VOTE_BUFFER_MAX_DELAY_MS
+SETTLE_SECONDS = 0.5
+
+
+def _new_post(rng: random.Random) -> dict[str, Any]:
+    return {"title": " ".join(rng.choices(WORDS, k=4)), "content": "benchmark"}
+
+
+def build_scenarios(data: SeededData, requests: int) -> list[Scenario]:
+    tokens = [create_access_token(data={"sub": str(id)}) for id in data.user_ids]
+
+    def auth(rng: random.Random) -> dict[str, str]:
+        return {"Authorization": f"Bearer {rng.choice(tokens)}"}
+
+    def post_id(rng: random.Random) -> str:
+        return str(rng.choices(data.post_ids, data.post_weights)[0])
+
+    return [
+        Scenario(
+            "GET /posts/",
+            lambda rng: {
+                "method": "GET",
+                "url": "/posts/",
+                "params": {"limit": rng.choice([10, 20, 50])},
+            },
+            requests,
+        ),
+        Scenario(
+            "GET /posts/trending",
+            lambda rng: {
+                "method": "GET",
+                "url": "/posts/trending",
+                "params": {"limit": rng.choice([10, 20, 50])},
+            },
+            requests,
+        ),
+        Scenario(
+            "GET /posts/{id}",
+            lambda rng: {"method": "GET", "url": f"/posts/{post_id(rng)}"},
+            requests,
+        ),
+        Scenario(
+            "POST /votes/",
+            lambda rng: {
+                "method": "POST",
+                "url": "/votes/",
+                "headers": auth(rng),
+                "json": {"post_id": post_id(rng), "dir": rng.randint(0, 1)},
+            },
+            requests,
+        ),
+        # Compare items_per_second to see what batching buys
+        Scenario(
+            "POST /posts/",
+            lambda rng: {
+                "method": "POST",
+                "url": "/posts/",
+                "headers": auth(rng),
+                "json": _new_post(rng),
+            },
+            requests,
+        ),
+        Scenario(
+            "POST /posts/bulk",
+            lambda rng: {
+                "method": "POST",
+                "url": "/posts/bulk",
+                "headers": auth(rng),
+                "json": [_new_post(rng) for _ in range(BULK_SIZE)],
+            },
+            max(requests // 10, 10),
+            items_per_request=BULK_SIZE,
+        ),
+        Scenario(
+            "GET /users/me",
+            lambda rng: {"method": "GET", "url": "/users/me", "headers": auth(rng)},
+            requests,
+        ),
+        # Every login hashes a password, so fewer of them cover the same ground
+        Scenario(
+            "POST /token",
+            lambda rng: {
+                "method": "POST",
+                "url": "/token",
+                "data": {"username": rng.choice(data.usernames), "password": PASSWORD},
+            },
+            max(requests // 10, 10),
+        ),
+    ]
+
+
+def _percentile(quantiles: list[float], p: int) -> float:
+    return round(quantiles[p - 1] * 1000, 3)
+
+
+QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def _query_count(response: httpx.Response) -> int:
+    match = QUERIES.search(response.headers.get("Server-Timing", ""))
+    return int(match.group(1)) if match else 0
+
+
+def _next_transaction_id(engine: Engine) -> int:
+    # Only transactions that write are given an id, reading it takes none
+    with engine.connect() as connection:
+        return connection.execute(
+            text("SELECT pg_snapshot_xmax(pg_current_snapshot())::text::bigint")
+        ).scalar_one()
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    engine: Engine,
+    scenario: Scenario,
+    *,
+    concurrency: int,
+    warmup: int,
+    rng: random.Random,
+) -> ScenarioResult:
+    for _ in range(warmup):
+        await client.request(**scenario.make_request(rng))
+    await asyncio.sleep(SETTLE_SECONDS)
+    first_transaction_id = _next_transaction_id(engine)
+    # Build requests up front so the timed loop only does I/O
+    pending = [scenario.make_request(rng) for _ in range(scenario.requests)]
+    latencies: list[float] = []
+    statuses: Counter[int] = Counter()
+    queries: list[int] = []
+
+    async def worker() -> None:
+        while pending:
+            request = pending.pop()
+            started = time.perf_counter()
+            r = await client.request(**request)
+            latencies.append(time.perf_counter() - started)
+            statuses[r.status_code] += 1
+            queries.append(_query_count(r))
+
+    started = time.perf_counter()
+    async with asyncio.TaskGroup() as tg:
+        for _ in range(concurrency):
+            tg.create_task(worker())
+    seconds = time.perf_counter() - started
+    await asyncio.sleep(SETTLE_SECONDS)
+    write_transactions = _next_transaction_id(engine) - first_transaction_id
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return ScenarioResult(
+        name=scenario.name,
+        requests=scenario.requests,
+        # 4xx is expected, e.g. a 409 for repeating a vote
+        errors=sum(n for code, n in statuses.items() if code >= 500),
+        statuses=dict(sorted(statuses.items())),
+        seconds=round(seconds, 3),
+        throughput=round(scenario.requests / seconds, 1),
+        items_per_second=round(
+            scenario.requests * scenario.items_per_request / seconds, 1
+        ),
+        p50_ms=_percentile(quantiles, 50),
+        p95_ms=_percentile(quantiles, 95),
+        p99_ms=_percentile(quantiles, 99),
+        queries_per_request=round(statistics.fmean(queries), 2),
+        write_transactions=write_transactions,
+        commits_per_second=round(write_transactions / seconds, 1),
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(
+    database_url: str, port: int, *, vote_buffer: bool
+) -> subprocess.Popen[bytes]:
+    # Per-request log lines would cost more than some of the routes measured
+    env = os.environ | {
+        "DATABASE_URL": database_url,
+        "LOG_LEVEL": "WARNING",
+        "VOTE_BUFFER_ENABLED": str(vote_buffer).lower(),
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+            "--no-access-log",
+        ],
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/health").raise_for_status()
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start within 30 seconds")
+
+
+async def drive(
+    base_url: str,
+    engine: Engine,
+    scenarios: list[Scenario],
+    *,
+    concurrency: int,
+    warmup: int,
+    rng: random.Random,
+) -> list[ScenarioResult]:
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+        return [
+            await run_scenario(
+                client,
+                engine,
+                scenario,
+                concurrency=concurrency,
+                warmup=warmup,
+                rng=rng,
+            )
+            for scenario in scenarios
+        ]
+
+
+def _git_revision() -> str | None:
+    try:
+        git = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        )
+    except OSError:
+        return None
+    return git.stdout.strip() if git.returncode == 0 else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--database-url",
+        default=os.environ.get("BENCH_DATABASE_URL"),
+        required="BENCH_DATABASE_URL" not in os.environ,
+        help="database to wipe and seed, BENCH_DATABASE_URL by default",
+    )
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--posts", type=int, default=10_000)
+    parser.add_argument("--votes-per-user", type=int, default=50)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent")
+    parser.add_argument("--requests", type=int, default=2_000, help="per route")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", action="append", help="run matching routes only")
+    parser.add_argument(
+        "--vote-buffer",
+        action="store_true",
+        help="serve with VOTE_BUFFER_ENABLED, compare commits_per_second",
+    )
+    parser.add_argument("--output", help="write results here instead of stdout")
+    args = parser.parse_args()
+
+    started_at = datetime.now(UTC)
+    rng = random.Random(args.seed)
+    alembic_cfg = Config("alembic.ini")
+    alembic_cfg.set_main_option("sqlalchemy.url", args.database_url)
+    command.upgrade(alembic_cfg, "head")
+    engine = create_engine(args.database_url)
+    data = seed(
+        engine,
+        users=args.users,
+        posts=args.posts,
+        votes_per_user=args.votes_per_user,
+        skew=args.skew,
+        rng=rng,
+    )
+    scenarios = build_scenarios(data, args.requests)
+    if args.only:
+        scenarios = [s for s in scenarios if any(o in s.name for o in args.only)]
+
+    port = _free_port()
+    server = start_server(args.database_url, port, vote_buffer=args.vote_buffer)
+    try:
+        results = asyncio.run(
+            drive(
+                f"http://127.0.0.1:{port}",
+                engine,
+                scenarios,
+                concurrency=args.concurrency,
+                warmup=args.warmup,
+                rng=rng,
+            )
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "revision": _git_revision(),
+        "started_at": started_at.isoformat(),
+        "parameters": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in {"database_url", "output"}
+        },
+        "results": [asdict(result) for result in results],
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import random
+import uuid
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import Engine, insert, text, update
+from sqlmodel import SQLModel, func, select
+
+from app.core.security import hash_password
+from app.models import Post, PostScore, User, Vote
+from app.trending import hot_score, window_start
+
+PASSWORD = "benchmark123"
+CHUNK_SIZE = 5_000
+WORDS = (
+    "python fastapi postgres latency index cache vote feed search query pool "
+    "async worker token argon2 cursor page trending score replica stream "
+    "pizza skyscraper coffee mountain river garden bicycle guitar chess"
+).split()
+
+
+@dataclass
+class SeededData:
+    user_ids: list[uuid.UUID]
+    usernames: list[str]
+    # Most popular first, with the weights votes were drawn with
+    post_ids: list[uuid.UUID]
+    post_weights: list[float]
+
+
+def _chunks[T](items: list[T]) -> list[list[T]]:
+    return [items[i : i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]
+
+
+def seed(
+    engine: Engine,
+    *,
+    users: int,
+    posts: int,
+    votes_per_user: int,
+    skew: float,
+    rng: random.Random,
+) -> SeededData:
+    """Replace every row in the database with a generated data set.
+
+    Votes follow a Zipf-like distribution with exponent `skew`, so a few posts
+    collect most of them like on a real feed.
+    """
+    # Argon2 is slow on purpose, every user shares one hash
+    hashed_password = hash_password(PASSWORD)
+    now = datetime.now(UTC)
+    user_rows = [
+        {
+            "id": uuid.uuid4(),
+            "username": f"bench{i}",
+            "email": f"bench{i}@example.com",
+            "hashed_password": hashed_password,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for i in range(users)
+    ]
+    post_rows = []
+    for i in range(posts):
+        created_at = now - timedelta(minutes=posts - i)
+        post_rows.append(
+            {
+                "id": uuid.uuid4(),
+                "title": f"post {i} {rng.choice(WORDS)} {rng.choice(WORDS)}",
+                "content": " ".join(rng.choices(WORDS, k=30)),
+                "published": rng.random() < 0.9,
+                "owner_id": rng.choice(user_rows)["id"],
+                "created_at": created_at,
+                "updated_at": created_at,
+            }
+        )
+    popular = rng.sample([row["id"] for row in post_rows], len(post_rows))
+    weights = [1 / (rank + 1) ** skew for rank in range(len(popular))]
+    vote_rows = []
+    for user in user_rows:
+        voted: set[uuid.UUID] = set()
+        target = min(votes_per_user, len(popular))
+        while len(voted) < target:
+            voted.update(rng.choices(popular, weights, k=target - len(voted)))
+        vote_rows.extend({"user_id": user["id"], "post_id": id} for id in voted)
+
+    with engine.begin() as connection:
+        for table in reversed(SQLModel.metadata.sorted_tables):
+            connection.execute(table.delete())
+        for chunk in _chunks(user_rows):
+            connection.execute(insert(User), chunk)
+        for chunk in _chunks(post_rows):
+            connection.execute(insert(Post), chunk)
+        for chunk in _chunks(vote_rows):
+            connection.execute(insert(Vote), chunk)
+        vote_count = (
+            select(func.count()).where(Vote.post_id == Post.id).scalar_subquery()
+        )
+        connection.execute(update(Post).values(vote_count=vote_count))
+        # What the app's first trending refresh would write
+        recent = select(
+            Post.id,
+            Post.vote_count,
+            Post.created_at,
+            hot_score(Post.vote_count, Post.created_at),
+        ).where(Post.created_at >= window_start())
+        connection.execute(
+            insert(PostScore).from_select(
+                ["post_id", "vote_count", "created_at", "score"], recent
+            )
+        )
+        # Plan queries against the new data, not whatever was there before
+        connection.execute(text("ANALYZE"))
+    return SeededData(
+        user_ids=[row["id"] for row in user_rows],
+        usernames=[row["username"] for row in user_rows],
+        post_ids=popular,
+        post_weights=weights,
+    )
@@ -2,4 +2,13 @@
 
 uv run alembic upgrade head
 
-uv run uvicorn app.main:app --host 0.0.0.0 --port 8000 --workers 4
+# Workers write metrics to files here for app.metrics_server to sum,
+# start clean so counters from a previous run aren't added in
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# Metrics go out on their own port, which only Fly's scraper can reach
+uv run python -m app.metrics_server &
+
+uv run uvicorn app.main:app --host 0.0.0.0 --port 8000 --workers "${WEB_CONCURRENCY:-4}"
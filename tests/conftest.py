@@ -1,16 +1,21 @@
 import uuid
-from collections.abc import Generator, Sequence
+from collections.abc import AsyncGenerator, Callable, Generator, Sequence
+from contextlib import AbstractContextManager, contextmanager
+from typing import Any
 
 import pytest
 from alembic.config import Config, command
 from fastapi.testclient import TestClient
 from httpx import Headers
-from sqlalchemy import Engine
-from sqlmodel import Session, create_engine, select
+from sqlalchemy import Engine, NullPool, event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core.config import config
+from app.core.db import get_async_database_url, instrument_engine
 from app.core.security import create_access_token, hash_password
-from app.deps import get_session
+from app.deps import feed_cache, get_session, jobs
 from app.main import app
 from app.models import Post, User, UserCreate
 
@@ -20,6 +25,16 @@ def engine() -> Engine:
     return create_engine(str(config.test_database_url))
 
 
+@pytest.fixture(scope="session")
+def async_engine() -> AsyncEngine:
+    # Every TestClient runs its own event loop, so connections can't be pooled
+    async_engine = create_async_engine(
+        get_async_database_url(config.test_database_url), poolclass=NullPool
+    )
+    instrument_engine(async_engine)
+    return async_engine
+
+
 @pytest.fixture(scope="session", autouse=True)
 def setup_database() -> Generator[None]:
     alembic_cfg = Config("alembic.ini")
@@ -29,26 +44,68 @@ def setup_database() -> Generator[None]:
     command.downgrade(alembic_cfg, "base")
 
 
+@pytest.fixture(scope="session", autouse=True)
+def eager_jobs() -> Generator[None]:
+    # Run background jobs inline, so their effects are seen once a request returns
+    jobs.eager = True
+    yield
+    jobs.eager = False
+
+
 @pytest.fixture(name="session")
 def session_fixture(engine: Engine) -> Generator[Session]:
-    connection = engine.connect()
-    transaction = connection.begin()
-    session = Session(bind=connection, join_transaction_mode="create_savepoint")
-    yield session
-    session.close()
-    transaction.rollback()
-    connection.close()
+    with Session(engine) as session:
+        yield session
+    # The app commits on its own connections, so clean up after each test
+    with engine.begin() as connection:
+        for table in reversed(SQLModel.metadata.sorted_tables):
+            connection.execute(table.delete())
 
 
 @pytest.fixture(name="client")
-def client_fixture(session: Session) -> Generator[TestClient]:
+def client_fixture(
+    session: Session,  # noqa: ARG001
+    async_engine: AsyncEngine,
+) -> Generator[TestClient]:
+    async def get_session_override() -> AsyncGenerator[AsyncSession]:
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            yield session
+
     # Set session ovverride before startup lifecycle events trigger
-    app.dependency_overrides[get_session] = lambda: session
+    app.dependency_overrides[get_session] = get_session_override
     with TestClient(app) as client:
+        # Rows are wiped between tests, so don't serve pages cached before that
+        client.portal.call(feed_cache.invalidate)
         yield client
     app.dependency_overrides.clear()
 
 
+@pytest.fixture
+def assert_max_queries(
+    async_engine: AsyncEngine,
+) -> Callable[[int], AbstractContextManager[list[str]]]:
+    """Fail when the block runs more than `max_queries` statements on the app."""
+
+    @contextmanager
+    def assert_max_queries(max_queries: int) -> Generator[list[str]]:
+        statements: list[str] = []
+
+        def record(_conn: Any, _cursor: Any, statement: str, *_args: Any) -> None:
+            statements.append(statement)
+
+        event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+        assert len(statements) <= max_queries, (
+            f"{len(statements)} queries, expected at most {max_queries}:\n"
+            + "\n\n".join(statements)
+        )
+
+    return assert_max_queries
+
+
 class _TestDBUser(UserCreate):
     """Models a user saved in db for testing."""
 
@@ -84,5 +141,5 @@ def db_posts(session: Session, db_user: _TestDBUser) -> Sequence[Post]:
 
 @pytest.fixture
 def token_headers(db_user: _TestDBUser) -> Headers:
-    access_token = create_access_token(data={"sub": db_user.username})
+    access_token = create_access_token(data={"sub": str(db_user.id)})
     return Headers({"Authorization": f"Bearer {access_token}"})
@@ -1,7 +1,16 @@
+import uuid
+from collections.abc import Sequence
+
 import pytest
 from fastapi import status
 from fastapi.testclient import TestClient
+from httpx import Headers
+from sqlmodel import Session
 
+from app.core.concurrency import ConcurrencyLimiter
+from app.core.security import create_access_token, password_hash_pool
+from app.deps import invalidate_user, token_revocations, user_cache
+from app.models import Post, User
 from tests.conftest import _TestDBUser
 
 
@@ -29,6 +38,33 @@ def test_token(client: TestClient, db_user: _TestDBUser) -> None:
     assert "access_token" in data
 
 
+def test_token_hashes_on_password_pool(
+    client: TestClient, db_user: _TestDBUser
+) -> None:
+    completed = password_hash_pool.completed
+    r = client.post(
+        "/token",
+        data={"username": db_user.username, "password": db_user.password},
+    )
+    assert r.status_code == status.HTTP_200_OK
+    assert password_hash_pool.completed == completed + 1
+    assert password_hash_pool.pending == 0
+
+
+def test_token_rejected_when_auth_is_saturated(
+    monkeypatch: pytest.MonkeyPatch, client: TestClient, db_user: _TestDBUser
+) -> None:
+    limiter = ConcurrencyLimiter(limit=0, timeout=0.01)
+    monkeypatch.setattr("app.deps.auth_limiter", limiter)
+    r = client.post(
+        "/token",
+        data={"username": db_user.username, "password": db_user.password},
+    )
+    assert r.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert r.headers["Retry-After"] == "1"
+    assert limiter.rejected == 1
+
+
 @pytest.mark.parametrize(
     "username, password, status_code",
     [
@@ -55,3 +91,111 @@ def test_incorrect_token(
     if status_code == status.HTTP_401_UNAUTHORIZED:
         data = r.json()
         assert "access_token" not in data
+
+
+def test_read_users_me(
+    client: TestClient, db_user: _TestDBUser, token_headers: Headers
+) -> None:
+    r = client.get("/users/me", headers=token_headers)
+    assert r.status_code == status.HTTP_200_OK
+    data = r.json()
+    assert data["id"] == str(db_user.id)
+    assert data["username"] == db_user.username
+
+
+def test_read_users_me_with_username_subject(
+    client: TestClient, db_user: _TestDBUser
+) -> None:
+    access_token = create_access_token(data={"sub": db_user.username})
+    r = client.get("/users/me", headers={"Authorization": f"Bearer {access_token}"})
+    assert r.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_read_users_me_is_cached_until_invalidated(
+    session: Session,
+    client: TestClient,
+    db_user: _TestDBUser,
+    token_headers: Headers,
+) -> None:
+    client.get("/users/me", headers=token_headers)
+    user = session.get(User, db_user.id)
+    assert user
+    user.email = "changed@gmail.com"
+    session.add(user)
+    session.commit()
+    r = client.get("/users/me", headers=token_headers)
+    assert r.json()["email"] == db_user.email
+    client.portal.call(invalidate_user, db_user.id)
+    r = client.get("/users/me", headers=token_headers)
+    assert r.json()["email"] == "changed@gmail.com"
+    cached_user = client.portal.call(user_cache.get, str(db_user.id))
+    assert cached_user is not None
+    assert "hashed_password" not in cached_user
+
+
+def test_logout_revokes_the_token(
+    client: TestClient, db_user: _TestDBUser, token_headers: Headers
+) -> None:
+    other_token = create_access_token(data={"sub": str(db_user.id)})
+    r = client.post("/logout", headers=token_headers)
+    assert r.status_code == status.HTTP_200_OK
+    r = client.get("/users/me", headers=token_headers)
+    assert r.status_code == status.HTTP_401_UNAUTHORIZED
+    r = client.get("/users/me", headers={"Authorization": f"Bearer {other_token}"})
+    assert r.status_code == status.HTTP_200_OK
+
+
+def test_logout_everywhere_revokes_older_tokens(
+    client: TestClient, db_user: _TestDBUser, token_headers: Headers
+) -> None:
+    r = client.post("/logout/all", headers=token_headers)
+    assert r.status_code == status.HTTP_200_OK
+    r = client.post(
+        "/votes/", headers=token_headers, json={"post_id": str(uuid.uuid4()), "dir": 1}
+    )
+    assert r.status_code == status.HTTP_401_UNAUTHORIZED
+    # With the revocations gone, the stored token version still rejects it
+    token_revocations.backend.clear()  # ty:ignore[unresolved-attribute]
+    r = client.get("/users/me", headers=token_headers)
+    assert r.status_code == status.HTTP_401_UNAUTHORIZED
+    r = client.post(
+        "/token", data={"username": db_user.username, "password": db_user.password}
+    )
+    new_headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = client.get("/users/me", headers=new_headers)
+    assert r.status_code == status.HTTP_200_OK
+
+
+def test_logout_everywhere_keeps_changes_made_since_caching(
+    client: TestClient, session: Session, db_user: _TestDBUser, token_headers: Headers
+) -> None:
+    client.get("/users/me", headers=token_headers)
+    user = session.get_one(User, db_user.id)
+    user.email = "changed@gmail.com"
+    session.add(user)
+    session.commit()
+    r = client.post("/logout/all", headers=token_headers)
+    assert r.status_code == status.HTTP_200_OK
+    session.refresh(user)
+    assert user.email == "changed@gmail.com"
+    assert user.token_version == 1
+
+
+def test_writes_by_a_deleted_user_are_unauthorized(
+    client: TestClient, db_posts: Sequence[Post]
+) -> None:
+    # Signed for a user that no longer exists, writes don't load the user
+    headers = {
+        "Authorization": "Bearer "
+        + create_access_token(data={"sub": str(uuid.uuid4())})
+    }
+    post = {"title": "t", "content": "c"}
+    vote = {"post_id": str(db_posts[0].id), "dir": 1}
+    for path, body in [
+        ("/posts/", post),
+        ("/posts/bulk", [post]),
+        ("/votes/", vote),
+        ("/votes/batch", [vote]),
+    ]:
+        r = client.post(path, headers=headers, json=body)
+        assert r.status_code == status.HTTP_401_UNAUTHORIZED, path
@@ -1,13 +1,32 @@
-from collections.abc import Sequence
+import asyncio
+import csv
+import io
+import json
+from collections.abc import Callable, Sequence
+from contextlib import AbstractContextManager
+from typing import Any
 
 import pytest
 from fastapi import status
 from fastapi.testclient import TestClient
 from httpx import Headers
-from sqlmodel import Session
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import Session, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app.core.config import config
 from app.core.security import create_access_token, hash_password
-from app.models import Post, PostPublic, PostPublicWithVotes, User
+from app.deps import feed_cache
+from app.models import (
+    BulkPostResult,
+    Post,
+    PostExport,
+    PostPublic,
+    PostPublicWithVotes,
+    User,
+)
+from app.routers import posts as posts_router
+from app.trending import refresh_post_scores
 from tests.conftest import _TestDBUser
 
 
@@ -60,11 +79,76 @@ def test_create_post_default_published_true(
     assert new_post.owner_id == db_user.id
 
 
+def test_create_posts_in_bulk(
+    client: TestClient, session: Session, db_user: _TestDBUser, token_headers: Headers
+) -> None:
+    r = client.post(
+        "/posts/bulk",
+        headers=token_headers,
+        json=[
+            {"title": "first", "content": "bulk"},
+            {"title": "missing content"},
+            {"title": "third", "content": "bulk", "published": False},
+        ],
+    )
+    assert r.status_code == status.HTTP_200_OK
+    result = BulkPostResult.model_validate(r.json())
+    assert result.created == 2
+    assert [error.index for error in result.errors] == [1]
+    assert result.errors[0].detail[0]["loc"] == ["content"]
+    posts = session.exec(select(Post).where(col(Post.id).in_(result.ids))).all()
+    assert sorted(post.title for post in posts) == ["first", "third"]
+    assert all(post.owner_id == db_user.id for post in posts)
+
+
+def test_create_posts_in_bulk_from_ndjson(
+    client: TestClient, token_headers: Headers, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # Several INSERT statements
+    monkeypatch.setattr(config, "bulk_create_chunk_size", 2)
+    lines = [json.dumps({"title": f"post {i}", "content": "bulk"}) for i in range(5)]
+    lines.insert(2, "{not json")
+    r = client.post(
+        "/posts/bulk",
+        headers={**token_headers, "Content-Type": "application/x-ndjson"},
+        content="\n".join(lines) + "\n",
+    )
+    assert r.status_code == status.HTTP_200_OK
+    result = BulkPostResult.model_validate(r.json())
+    assert result.created == 5
+    assert [error.index for error in result.errors] == [2]
+    r = client.get("/posts/")
+    assert len(r.json()) == 5
+
+
+def test_create_posts_in_bulk_over_limit(
+    client: TestClient, token_headers: Headers, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config, "bulk_create_max_items", 2)
+    posts = [{"title": "title", "content": "content"}] * 3
+    r = client.post("/posts/bulk", headers=token_headers, json=posts)
+    assert r.status_code == status.HTTP_413_CONTENT_TOO_LARGE
+    r = client.get("/posts/")
+    assert r.json() == []
+
+
+def test_create_posts_in_bulk_with_invalid_body(
+    client: TestClient, token_headers: Headers
+) -> None:
+    r = client.post("/posts/bulk", headers=token_headers, json={"title": "title"})
+    assert r.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+
 def test_create_post_unauthorized_without_headers(client: TestClient) -> None:
     r = client.post("/posts/")
     assert r.status_code == status.HTTP_401_UNAUTHORIZED
 
 
+async def _refresh_post_scores(async_engine: AsyncEngine) -> None:
+    async with AsyncSession(async_engine) as session:
+        await refresh_post_scores(session)
+
+
 def test_read_posts(
     client: TestClient,
     db_posts: Sequence[Post],
@@ -81,11 +165,299 @@ def test_read_posts(
     assert posts[0].Post.id == db_posts[0].id
 
 
+def test_read_posts_with_cursor(
+    client: TestClient,
+    db_posts: Sequence[Post],
+) -> None:
+    r = client.get("/posts/", params={"limit": 2})
+    assert r.status_code == status.HTTP_200_OK
+    first_page = [PostPublicWithVotes.model_validate(post) for post in r.json()]
+    assert len(first_page) == 2
+    cursor = r.headers["X-Next-Cursor"]
+    r = client.get("/posts/", params={"limit": 2, "cursor": cursor})
+    assert r.status_code == status.HTTP_200_OK
+    second_page = [PostPublicWithVotes.model_validate(post) for post in r.json()]
+    assert len(second_page) == 1
+    assert "X-Next-Cursor" not in r.headers
+    post_ids = [result.Post.id for result in first_page + second_page]
+    assert sorted(post_ids) == sorted(post.id for post in db_posts)
+
+
+def test_read_posts_with_invalid_cursor(client: TestClient) -> None:
+    r = client.get("/posts/", params={"cursor": "invalid_cursor"})
+    assert r.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_read_posts_limit_is_capped(client: TestClient) -> None:
+    r = client.get("/posts/", params={"limit": 1_000_000})
+    assert r.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+
+def test_read_posts_with_search(
+    client: TestClient,
+    db_posts: Sequence[Post],
+) -> None:
+    r = client.get("/posts/", params={"search": "first"})
+    assert r.status_code == status.HTTP_200_OK
+    posts = [PostPublicWithVotes.model_validate(post) for post in r.json()]
+    assert [result.Post.id for result in posts] == [db_posts[0].id]
+
+
+def test_read_posts_with_search_ranks_title_matches_first(
+    session: Session,
+    client: TestClient,
+    db_user: _TestDBUser,
+) -> None:
+    content_match = Post(
+        title="weekend plans", content="pizza with friends", owner_id=db_user.id
+    )
+    title_match = Post(title="best pizza", content="in town", owner_id=db_user.id)
+    session.add_all([title_match, content_match])
+    session.commit()
+    r = client.get("/posts/", params={"search": "pizza"})
+    assert r.status_code == status.HTTP_200_OK
+    posts = [PostPublicWithVotes.model_validate(post) for post in r.json()]
+    assert [result.Post.id for result in posts] == [title_match.id, content_match.id]
+
+
+def test_read_posts_with_search_and_cursor(
+    client: TestClient,
+    db_posts: Sequence[Post],
+) -> None:
+    r = client.get("/posts/", params={"search": "title", "limit": 2})
+    first_page = [PostPublicWithVotes.model_validate(post) for post in r.json()]
+    cursor = r.headers["X-Next-Cursor"]
+    r = client.get("/posts/", params={"search": "title", "limit": 2, "cursor": cursor})
+    assert r.status_code == status.HTTP_200_OK
+    second_page = [PostPublicWithVotes.model_validate(post) for post in r.json()]
+    post_ids = [result.Post.id for result in first_page + second_page]
+    assert sorted(post_ids) == sorted(post.id for post in db_posts)
+    # Cursors are bound to the query shape they were issued for
+    r = client.get("/posts/", params={"limit": 2, "cursor": cursor})
+    assert r.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_read_posts_with_search_pages_through_tied_ranks(
+    client: TestClient,
+    db_posts: Sequence[Post],
+) -> None:
+    # Every post matches equally, with a rank float4 can't represent exactly
+    params: dict[str, str | int] = {"search": "content", "limit": 1}
+    post_ids = []
+    while True:
+        r = client.get("/posts/", params=params)
+        assert r.status_code == status.HTTP_200_OK
+        post_ids += [post["Post"]["id"] for post in r.json()]
+        if "X-Next-Cursor" not in r.headers:
+            break
+        params["cursor"] = r.headers["X-Next-Cursor"]
+    assert sorted(post_ids) == sorted(str(post.id) for post in db_posts)
+
+
+def test_read_posts_is_cached_until_next_write(
+    client: TestClient,
+    session: Session,
+    db_posts: Sequence[Post],
+    token_headers: Headers,
+) -> None:
+    r = client.get("/posts/")
+    assert r.status_code == status.HTTP_200_OK
+    assert r.headers["Cache-Control"].startswith("public, max-age=")
+    assert len(r.json()) == len(db_posts)
+    # Writes outside the API aren't seen until the cached page expires
+    session.add(Post(title="direct", content="direct", owner_id=db_posts[0].owner_id))
+    session.commit()
+    r = client.get("/posts/")
+    assert len(r.json()) == len(db_posts)
+    client.post(
+        "/votes/",
+        headers=token_headers,
+        json={"post_id": str(db_posts[0].id), "dir": 1},
+    )
+    r = client.get("/posts/")
+    assert len(r.json()) == len(db_posts) + 1
+
+
+def test_read_posts_not_cached_across_invalidation(
+    client: TestClient,
+    session: Session,
+    db_posts: Sequence[Post],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    read_page = posts_router._read_posts_page
+
+    async def read_page_during_write(*args: Any, **kwargs: Any) -> Any:
+        page = await read_page(*args, **kwargs)
+        # A write commits and invalidates after the page's rows were read
+        await feed_cache.invalidate()
+        return page
+
+    monkeypatch.setattr(posts_router, "_read_posts_page", read_page_during_write)
+    client.get("/posts/")
+    monkeypatch.undo()
+    session.add(Post(title="direct", content="direct", owner_id=db_posts[0].owner_id))
+    session.commit()
+    r = client.get("/posts/")
+    assert len(r.json()) == len(db_posts) + 1
+
+
+def test_read_posts_not_modified(
+    client: TestClient, db_posts: Sequence[Post], token_headers: Headers
+) -> None:
+    r = client.get("/posts/", params={"limit": 2})
+    etag = r.headers["ETag"]
+    cursor = r.headers["X-Next-Cursor"]
+    r = client.get("/posts/", params={"limit": 2}, headers={"If-None-Match": etag})
+    assert r.status_code == status.HTTP_304_NOT_MODIFIED
+    assert r.content == b""
+    assert r.headers["X-Next-Cursor"] == cursor
+    client.delete(f"/posts/{db_posts[-1].id}", headers=token_headers)
+    r = client.get("/posts/", params={"limit": 2}, headers={"If-None-Match": etag})
+    assert r.status_code == status.HTTP_200_OK
+    assert r.headers["ETag"] != etag
+
+
+def test_read_posts_with_voted_by_me(
+    client: TestClient,
+    db_posts: Sequence[Post],
+    token_headers: Headers,
+    assert_max_queries: Callable[[int], AbstractContextManager[list[str]]],
+) -> None:
+    client.post(
+        "/votes/",
+        headers=token_headers,
+        json={"post_id": str(db_posts[0].id), "dir": 1},
+    )
+    r = client.get("/posts/")
+    assert all(post["voted_by_me"] is None for post in r.json())
+    with assert_max_queries(1):
+        r = client.get("/posts/", headers=token_headers)
+    assert r.status_code == status.HTTP_200_OK
+    assert r.headers["Cache-Control"] == "private, no-cache"
+    voted = {post["Post"]["id"]: post["voted_by_me"] for post in r.json()}
+    assert voted == {str(post.id): post is db_posts[0] for post in db_posts}
+
+
+def test_read_posts_with_invalid_token(client: TestClient) -> None:
+    r = client.get("/posts/", headers={"Authorization": "Bearer invalid"})
+    assert r.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_export_posts(
+    client: TestClient, db_posts: Sequence[Post], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # Several round trips through the server-side cursor
+    monkeypatch.setattr(config, "export_batch_size", 2)
+    r = client.get("/posts/export")
+    assert r.status_code == status.HTTP_200_OK
+    assert r.headers["content-type"] == "application/x-ndjson"
+    posts = [PostExport.model_validate_json(line) for line in r.text.splitlines()]
+    assert [post.id for post in posts] == [post.id for post in db_posts]
+    assert all(post.vote_count == 0 for post in posts)
+
+
+def test_export_posts_as_csv(client: TestClient, db_posts: Sequence[Post]) -> None:
+    r = client.get("/posts/export", params={"format": "csv"})
+    assert r.status_code == status.HTTP_200_OK
+    assert r.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(r.text)))
+    assert [row["id"] for row in rows] == [str(post.id) for post in db_posts]
+    assert rows[0]["title"] == db_posts[0].title
+    # No match still gets the header line
+    r = client.get("/posts/export", params={"format": "csv", "search": "nothing"})
+    assert r.text.splitlines() == [",".join(PostExport.model_fields)]
+
+
+def test_export_posts_with_filters(
+    client: TestClient, session: Session, db_posts: Sequence[Post]
+) -> None:
+    db_posts[1].published = False
+    session.add(db_posts[1])
+    session.commit()
+    r = client.get("/posts/export", params={"published": True, "search": "title"})
+    posts = [PostExport.model_validate_json(line) for line in r.text.splitlines()]
+    assert [post.id for post in posts] == [db_posts[0].id, db_posts[2].id]
+
+
+def test_read_trending_posts(
+    client: TestClient,
+    session: Session,
+    async_engine: AsyncEngine,
+    db_posts: Sequence[Post],
+) -> None:
+    first, second, unpublished = db_posts
+    second.vote_count, unpublished.vote_count = 5, 10
+    unpublished.published = False
+    session.add_all(db_posts)
+    session.commit()
+    r = client.get("/posts/trending")
+    assert r.json() == []
+    asyncio.run(_refresh_post_scores(async_engine))
+    r = client.get("/posts/trending")
+    assert r.status_code == status.HTTP_200_OK
+    ids = [post["Post"]["id"] for post in r.json()]
+    assert ids == [str(second.id), str(first.id)]
+    r = client.get("/posts/trending", params={"limit": 1})
+    assert len(r.json()) == 1
+
+
 def test_read_post(client: TestClient, db_posts: Sequence[Post]) -> None:
     r = client.get(f"/posts/{db_posts[0].id}")
     assert r.status_code == status.HTTP_200_OK
 
 
+def test_read_post_not_modified(
+    client: TestClient, db_posts: Sequence[Post], token_headers: Headers
+) -> None:
+    r = client.get(f"/posts/{db_posts[0].id}")
+    etag = r.headers["ETag"]
+    r = client.get(f"/posts/{db_posts[0].id}", headers={"If-None-Match": etag})
+    assert r.status_code == status.HTTP_304_NOT_MODIFIED
+    assert r.content == b""
+    assert r.headers["ETag"] == etag
+    client.post(
+        "/votes/",
+        headers=token_headers,
+        json={"post_id": str(db_posts[0].id), "dir": 1},
+    )
+    r = client.get(f"/posts/{db_posts[0].id}", headers={"If-None-Match": etag})
+    assert r.status_code == status.HTTP_200_OK
+    assert r.headers["ETag"] != etag
+    assert r.json()["votes"] == 1
+
+
+def test_read_post_runs_one_query(
+    client: TestClient,
+    db_posts: Sequence[Post],
+    assert_max_queries: Callable[[int], AbstractContextManager[list[str]]],
+) -> None:
+    with assert_max_queries(1):
+        r = client.get(f"/posts/{db_posts[0].id}")
+    assert r.status_code == status.HTTP_200_OK
+    assert "db;dur=" in r.headers["Server-Timing"]
+    assert 'desc="1 queries"' in r.headers["Server-Timing"]
+
+
+def test_read_post_with_voted_by_me(
+    client: TestClient,
+    db_posts: Sequence[Post],
+    token_headers: Headers,
+    assert_max_queries: Callable[[int], AbstractContextManager[list[str]]],
+) -> None:
+    with assert_max_queries(1):
+        r = client.get(f"/posts/{db_posts[0].id}", headers=token_headers)
+    assert r.json()["voted_by_me"] is False
+    etag = r.headers["ETag"]
+    client.post(
+        "/votes/",
+        headers=token_headers,
+        json={"post_id": str(db_posts[0].id), "dir": 1},
+    )
+    r = client.get(f"/posts/{db_posts[0].id}", headers=token_headers)
+    assert r.json()["voted_by_me"] is True
+    assert r.headers["ETag"] != etag
+
+
 def test_read_post_with_nonexisting_valid_id(client: TestClient) -> None:
     nonexisting_valid_id = "63df3284-94fe-42e2-be37-dfc6d38f374e"
     r = client.get(f"/posts/{nonexisting_valid_id}")
@@ -147,7 +519,7 @@ def test_update_post_with_different_owner(
     session.add(new_user)
     session.commit()
     session.refresh(new_user)
-    new_user_access_token = create_access_token(data={"sub": "123hello"})
+    new_user_access_token = create_access_token(data={"sub": str(new_user.id)})
     new_user_token_headers = {"Authorization": f"Bearer {new_user_access_token}"}
     r = client.put(
         f"/posts/{db_posts[0].id}",
@@ -193,7 +565,7 @@ def test_delete_post_with_different_owner(
     session.add(new_user)
     session.commit()
     session.refresh(new_user)
-    new_user_access_token = create_access_token(data={"sub": "123hello"})
+    new_user_access_token = create_access_token(data={"sub": str(new_user.id)})
     new_user_token_headers = {"Authorization": f"Bearer {new_user_access_token}"}
     r = client.delete(f"/posts/{db_posts[0].id}", headers=new_user_token_headers)
     assert r.status_code == status.HTTP_403_FORBIDDEN
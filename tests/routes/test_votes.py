@@ -1,10 +1,22 @@
-from collections.abc import Sequence
+import asyncio
+import uuid
+from collections.abc import Callable, Sequence
+from contextlib import AbstractContextManager
+from functools import partial
 
+import pytest
 from fastapi import status
 from fastapi.testclient import TestClient
 from httpx import Headers
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import Session
 
-from app.models import Post
+from app.core.buffer import WriteBuffer
+from app.core.config import config
+from app.core.security import create_access_token
+from app.models import Post, User
+from app.routers import votes
+from tests.conftest import _TestDBUser
 
 
 def test_add_vote(
@@ -18,6 +30,22 @@ def test_add_vote(
     assert r.status_code == status.HTTP_200_OK
 
 
+def test_add_vote_runs_one_query(
+    client: TestClient,
+    db_posts: Sequence[Post],
+    token_headers: Headers,
+    assert_max_queries: Callable[[int], AbstractContextManager[list[str]]],
+) -> None:
+    # The caller comes from the token, only the vote itself hits the database
+    with assert_max_queries(1):
+        r = client.post(
+            "/votes/",
+            headers=token_headers,
+            json={"post_id": str(db_posts[0].id), "dir": 1},
+        )
+    assert r.status_code == status.HTTP_200_OK
+
+
 def test_add_vote_twice(
     client: TestClient, db_posts: Sequence[Post], token_headers: Headers
 ) -> None:
@@ -80,3 +108,167 @@ def test_vote_unauthorized_without_headers(
 ) -> None:
     r = client.post("/votes/", json={"post_id": str(db_posts[0].id), "dir": 1})
     assert r.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_vote_updates_post_vote_count(
+    client: TestClient, db_posts: Sequence[Post], token_headers: Headers
+) -> None:
+    post_id = str(db_posts[0].id)
+    client.post("/votes/", headers=token_headers, json={"post_id": post_id, "dir": 1})
+    r = client.get(f"/posts/{post_id}")
+    assert r.json()["votes"] == 1
+    client.post("/votes/", headers=token_headers, json={"post_id": post_id, "dir": 0})
+    r = client.get(f"/posts/{post_id}")
+    assert r.json()["votes"] == 0
+
+
+def test_batch_votes(
+    client: TestClient, db_posts: Sequence[Post], token_headers: Headers
+) -> None:
+    nonexisting_valid_id = "63df3284-94fe-42e2-be37-dfc6d38f374e"
+    r = client.post(
+        "/votes/batch",
+        headers=token_headers,
+        json=[
+            {"post_id": str(db_posts[0].id), "dir": 1},
+            {"post_id": str(db_posts[1].id), "dir": 1},
+            {"post_id": str(db_posts[2].id), "dir": 0},
+            {"post_id": nonexisting_valid_id, "dir": 1},
+        ],
+    )
+    assert r.status_code == status.HTTP_200_OK
+    assert [result["status"] for result in r.json()] == [
+        "added",
+        "added",
+        "unchanged",
+        "not_found",
+    ]
+    r = client.post(
+        "/votes/batch",
+        headers=token_headers,
+        json=[
+            {"post_id": str(db_posts[0].id), "dir": 0},
+            {"post_id": str(db_posts[1].id), "dir": 1},
+        ],
+    )
+    assert [result["status"] for result in r.json()] == ["removed", "unchanged"]
+    votes = {post["Post"]["id"]: post["votes"] for post in client.get("/posts/").json()}
+    assert votes == {
+        str(db_posts[0].id): 0,
+        str(db_posts[1].id): 1,
+        str(db_posts[2].id): 0,
+    }
+
+
+def test_batch_votes_last_intent_wins(
+    client: TestClient, db_posts: Sequence[Post], token_headers: Headers
+) -> None:
+    post_id = str(db_posts[0].id)
+    r = client.post(
+        "/votes/batch",
+        headers=token_headers,
+        json=[{"post_id": post_id, "dir": 0}, {"post_id": post_id, "dir": 1}],
+    )
+    assert r.json() == [{"post_id": post_id, "dir": 1, "status": "added"}]
+
+
+def test_batch_votes_with_empty_batch(
+    client: TestClient, token_headers: Headers
+) -> None:
+    r = client.post("/votes/batch", headers=token_headers, json=[])
+    assert r.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+
+def test_batch_votes_over_the_limit(
+    client: TestClient, db_posts: Sequence[Post], token_headers: Headers
+) -> None:
+    vote = {"post_id": str(db_posts[0].id), "dir": 1}
+    r = client.post(
+        "/votes/batch",
+        headers=token_headers,
+        json=[vote] * (config.vote_batch_max_items + 1),
+    )
+    assert r.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+
+def test_buffered_votes_are_coalesced(
+    client: TestClient,
+    session: Session,
+    async_engine: AsyncEngine,
+    db_posts: Sequence[Post],
+    token_headers: Headers,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    other_user = User(username="other", email="other@gmail.com", hashed_password="")
+    session.add(other_user)
+    session.commit()
+    other_headers = {
+        "Authorization": "Bearer "
+        + create_access_token(data={"sub": str(other_user.id)})
+    }
+    buffer: WriteBuffer[votes.VoteKey, int] = WriteBuffer(
+        partial(votes.flush_votes, engine=async_engine),
+        max_items=100,
+        max_delay=60,
+        max_attempts=1,
+        retry_delay=0,
+    )
+    monkeypatch.setattr(config, "vote_buffer_enabled", True)
+    monkeypatch.setattr(votes, "vote_buffer", buffer)
+    post_id = str(db_posts[0].id)
+    for headers, dir in [
+        (token_headers, 1),
+        (other_headers, 1),
+        (token_headers, 0),
+        (token_headers, 1),
+    ]:
+        r = client.post(
+            "/votes/", headers=headers, json={"post_id": post_id, "dir": dir}
+        )
+        assert r.status_code == status.HTTP_202_ACCEPTED
+    assert len(buffer) == 2
+    assert client.get(f"/posts/{post_id}").json()["votes"] == 0
+    client.portal.call(buffer.close)
+    # Both users' votes on the post went out in a single statement
+    assert buffer.flushes == 1
+    assert client.get(f"/posts/{post_id}").json()["votes"] == 2
+
+
+def test_concurrent_flushes_on_the_same_posts(
+    client: TestClient,
+    session: Session,
+    async_engine: AsyncEngine,
+    db_posts: Sequence[Post],
+) -> None:
+    users = [
+        User(username=f"voter{n}", email=f"voter{n}@gmail.com", hashed_password="")
+        for n in range(4)
+    ]
+    session.add_all(users)
+    session.commit()
+    # Every user votes on every post, half of them walking the posts backwards
+    batches = [
+        {(user.id, post.id): 1 for post in (db_posts[::-1] if n % 2 else db_posts)}
+        for n, user in enumerate(users)
+    ]
+
+    async def flush_all() -> None:
+        await asyncio.gather(
+            *(votes.flush_votes(batch, engine=async_engine) for batch in batches)
+        )
+
+    client.portal.call(flush_all)
+    for post in db_posts:
+        assert client.get(f"/posts/{post.id}").json()["votes"] == len(users)
+
+
+def test_flush_skips_votes_of_unknown_users(
+    client: TestClient,
+    async_engine: AsyncEngine,
+    db_posts: Sequence[Post],
+    db_user: _TestDBUser,
+) -> None:
+    post_id = db_posts[0].id
+    batch = {(db_user.id, post_id): 1, (uuid.uuid4(), post_id): 1}
+    client.portal.call(partial(votes.flush_votes, batch, engine=async_engine))
+    assert client.get(f"/posts/{post_id}").json()["votes"] == 1
@@ -0,0 +1,101 @@
+import asyncio
+
+from prometheus_client import REGISTRY
+
+from app.core.buffer import WriteBuffer
+
+
+def _buffer(
+    batches: list[dict[str, int]], max_items: int = 10, max_delay: float = 60
+) -> WriteBuffer[str, int]:
+    async def flush(batch: dict[str, int]) -> None:
+        batches.append(batch)
+
+    return WriteBuffer(
+        flush, max_items=max_items, max_delay=max_delay, max_attempts=1, retry_delay=0
+    )
+
+
+def test_later_writes_to_a_key_win() -> None:
+    batches: list[dict[str, int]] = []
+
+    async def main() -> None:
+        buffer = _buffer(batches)
+        for key, value in [("a", 1), ("b", 1), ("a", 0)]:
+            buffer.add(key, value)
+        assert len(buffer) == 2
+        await buffer.close()
+
+    asyncio.run(main())
+    assert batches == [{"a": 0, "b": 1}]
+
+
+def test_flushes_when_full() -> None:
+    batches: list[dict[str, int]] = []
+
+    async def main() -> None:
+        buffer = _buffer(batches, max_items=2)
+        for key in "abc":
+            buffer.add(key, 1)
+        await asyncio.sleep(0)
+        assert batches == [{"a": 1, "b": 1}]
+        await buffer.close()
+
+    asyncio.run(main())
+    assert batches == [{"a": 1, "b": 1}, {"c": 1}]
+
+
+def test_flushes_after_max_delay() -> None:
+    batches: list[dict[str, int]] = []
+
+    async def main() -> None:
+        buffer = _buffer(batches, max_delay=0.01)
+        buffer.add("a", 1)
+        await asyncio.sleep(0.05)
+        assert batches == [{"a": 1}]
+        assert buffer.flushes == 1
+
+    asyncio.run(main())
+
+
+def test_failed_flush_is_retried() -> None:
+    batches: list[dict[str, int]] = []
+
+    async def flush(batch: dict[str, int]) -> None:
+        batches.append(batch)
+        if len(batches) < 3:
+            raise RuntimeError("try again")
+
+    async def main() -> None:
+        buffer = WriteBuffer(
+            flush, max_items=1, max_delay=60, max_attempts=3, retry_delay=0.01
+        )
+        buffer.add("a", 1)
+        buffer.add("b", 1)
+        await buffer.close()
+
+    asyncio.run(main())
+    # The second batch waits until the first one is written
+    assert batches == [{"a": 1}, {"a": 1}, {"a": 1}, {"b": 1}]
+
+
+def test_failed_flush_is_dropped_after_max_attempts() -> None:
+    attempts: list[dict[str, int]] = []
+
+    async def flush(batch: dict[str, int]) -> None:
+        attempts.append(batch)
+        raise RuntimeError("database down")
+
+    async def main() -> None:
+        buffer = WriteBuffer(
+            flush, max_items=10, max_delay=60, max_attempts=2, retry_delay=0.01
+        )
+        buffer.add("a", 1)
+        await buffer.close()
+        assert len(buffer) == 0
+        assert buffer.flushes == 1
+
+    dropped = REGISTRY.get_sample_value("buffered_writes_dropped_total") or 0
+    asyncio.run(main())
+    assert len(attempts) == 2
+    assert REGISTRY.get_sample_value("buffered_writes_dropped_total") == dropped + 1
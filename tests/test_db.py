@@ -0,0 +1,104 @@
+import asyncio
+import logging
+
+import pytest
+from sqlalchemy import NullPool, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.config import config
+from app.core.db import (
+    InstrumentedPool,
+    QueryStats,
+    create_db_engine,
+    instrument_engine,
+    pool_stats,
+    query_stats,
+)
+
+
+async def _scalar(engine: AsyncEngine, statement: str) -> str:
+    try:
+        async with engine.connect() as connection:
+            return (await connection.execute(text(statement))).scalar_one()
+    finally:
+        await engine.dispose()
+
+
+def test_engine_records_pool_checkouts() -> None:
+    assert config.test_database_url
+    engine = create_db_engine(config.test_database_url)
+    assert isinstance(engine.pool, InstrumentedPool)
+    checkouts = pool_stats.checkouts
+    assert asyncio.run(_scalar(engine, "SELECT 1")) == 1
+    assert pool_stats.checkouts == checkouts + 1
+
+
+def test_engine_applies_statement_timeout(monkeypatch: pytest.MonkeyPatch) -> None:
+    assert config.test_database_url
+    monkeypatch.setattr(config, "db_statement_timeout_ms", 1500)
+    engine = create_db_engine(config.test_database_url)
+    assert asyncio.run(_scalar(engine, "SHOW statement_timeout")) == "1500ms"
+
+
+def test_engine_in_pgbouncer_mode(monkeypatch: pytest.MonkeyPatch) -> None:
+    assert config.test_database_url
+    monkeypatch.setattr(config, "db_pgbouncer", True)
+    # Sent as a startup option, which PgBouncer would refuse
+    monkeypatch.setattr(config, "db_statement_timeout_ms", 1500)
+    engine = create_db_engine(config.test_database_url)
+    assert isinstance(engine.pool, NullPool)
+    assert asyncio.run(_scalar(engine, "SHOW statement_timeout")) == "0"
+
+
+def test_engine_records_query_stats() -> None:
+    assert config.test_database_url
+    engine = create_db_engine(config.test_database_url)
+    instrument_engine(engine)
+    stats = QueryStats()
+    token = query_stats.set(stats)
+    try:
+        asyncio.run(_scalar(engine, "SELECT pg_sleep(0.01)::text"))
+    finally:
+        query_stats.reset(token)
+    assert stats.count == 1
+    assert stats.slowest_seconds >= 0.01
+    assert stats.slowest_statement == "SELECT pg_sleep(0.01)::text"
+
+
+def _log_slow_query(caplog: pytest.LogCaptureFixture) -> str:
+    assert config.test_database_url
+    engine = create_db_engine(config.test_database_url)
+    instrument_engine(engine)
+
+    async def sleep() -> None:
+        try:
+            async with engine.connect() as connection:
+                await connection.execute(
+                    text("SELECT pg_sleep(:seconds), :email"),
+                    {"seconds": 0.01, "email": "hello123@gmail.com"},
+                )
+        finally:
+            await engine.dispose()
+
+    with caplog.at_level(logging.WARNING, logger="app.core.db"):
+        asyncio.run(sleep())
+    return caplog.text
+
+
+def test_engine_logs_slow_queries(
+    monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    monkeypatch.setattr(config, "db_slow_query_ms", 5)
+    logged = _log_slow_query(caplog)
+    assert "SELECT pg_sleep(%(seconds)s), %(email)s" in logged
+    assert "-- parameters: seconds=float, email=str[18]" in logged
+    assert "hello123@gmail.com" not in logged
+
+
+def test_engine_logs_slow_queries_with_parameters(
+    monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    monkeypatch.setattr(config, "db_slow_query_ms", 5)
+    monkeypatch.setattr(config, "db_slow_query_log_parameters", True)
+    # Parameters are inlined, ready to run under EXPLAIN
+    assert "SELECT pg_sleep(0.01), 'hello123@gmail.com'" in _log_slow_query(caplog)
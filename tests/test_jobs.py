@@ -0,0 +1,205 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import Session, select
+
+from app.core.jobs import JobRunner
+from app.models import Job
+
+
+def _runner(engine: AsyncEngine | None = None, **kwargs: float) -> JobRunner:
+    options = {"max_size": 100, "batch_size": 10, "max_attempts": 3} | kwargs
+    return JobRunner(
+        max_size=int(options["max_size"]),
+        batch_size=int(options["batch_size"]),
+        max_attempts=int(options["max_attempts"]),
+        retry_delay=0.01,
+        engine=engine,
+        poll_interval=0.01,
+    )
+
+
+def test_jobs_run_after_enqueue_returns() -> None:
+    ran: list[int] = []
+
+    async def job(n: int) -> None:
+        ran.append(n)
+
+    async def main() -> None:
+        runner = _runner()
+        runner.start()
+        await runner.enqueue(job, 1)
+        assert ran == []
+        await runner.drain(timeout=1)
+        assert ran == [1]
+
+    asyncio.run(main())
+
+
+def test_equal_jobs_in_a_batch_run_once() -> None:
+    ran: list[int] = []
+
+    async def job(n: int) -> None:
+        ran.append(n)
+
+    async def main() -> None:
+        runner = _runner()
+        runner.start()
+        for n in [1, 2, 1, 1, 2]:
+            await runner.enqueue(job, n)
+        await runner.drain(timeout=1)
+
+    asyncio.run(main())
+    assert ran == [1, 2]
+
+
+def test_jobs_with_unhashable_arguments_run() -> None:
+    ran: list[list[int]] = []
+
+    async def job(ns: list[int]) -> None:
+        ran.append(ns)
+
+    async def main() -> None:
+        runner = _runner()
+        runner.start()
+        for ns in [[1], [1], [2]]:
+            await runner.enqueue(job, ns)
+        await runner.drain(timeout=1)
+
+    asyncio.run(main())
+    assert ran == [[1], [1], [2]]
+
+
+def test_failed_jobs_are_retried() -> None:
+    attempts: list[int] = []
+
+    async def flaky() -> None:
+        attempts.append(len(attempts))
+        if len(attempts) < 3:
+            raise RuntimeError("try again")
+
+    async def always_fails() -> None:
+        raise RuntimeError("never works")
+
+    async def main() -> None:
+        runner = _runner()
+        runner.start()
+        await runner.enqueue(flaky)
+        await runner.enqueue(always_fails)
+        await runner.drain(timeout=1)
+
+    asyncio.run(main())
+    assert attempts == [0, 1, 2]
+
+
+def test_full_queue_runs_jobs_inline() -> None:
+    ran: list[int] = []
+
+    async def job(n: int) -> None:
+        ran.append(n)
+
+    async def main() -> None:
+        runner = _runner(max_size=1)
+        runner.start()
+        await runner.enqueue(job, 1)
+        await runner.enqueue(job, 2)
+        assert ran == [2]
+        await runner.drain(timeout=1)
+
+    asyncio.run(main())
+    assert ran == [2, 1]
+
+
+def test_eager_jobs_run_inline() -> None:
+    ran: list[int] = []
+
+    async def job(n: int) -> None:
+        ran.append(n)
+
+    async def main() -> None:
+        runner = JobRunner(
+            max_size=10, batch_size=10, max_attempts=1, retry_delay=0, eager=True
+        )
+        runner.start()
+        await runner.enqueue(job, 1)
+        assert ran == [1]
+
+    asyncio.run(main())
+
+
+def test_durable_jobs_wait_in_the_table(
+    session: Session, async_engine: AsyncEngine
+) -> None:
+    ran: list[int] = []
+    runner = _runner(async_engine)
+
+    @runner.durable
+    async def job(n: int) -> None:
+        ran.append(n)
+
+    async def main() -> None:
+        # Stored even with no worker running, as after a crash
+        await runner.enqueue(job, 1)
+        assert ran == []
+        assert [row.args for row in session.exec(select(Job))] == [[1]]
+        runner.start()
+        async with asyncio.timeout(5):
+            while not ran:
+                await asyncio.sleep(0.01)
+        await runner.drain(timeout=1)
+
+    asyncio.run(main())
+    assert ran == [1]
+    assert session.exec(select(Job)).all() == []
+
+
+def test_durable_jobs_run_on_one_worker(
+    session: Session, async_engine: AsyncEngine
+) -> None:
+    ran: list[int] = []
+    runners = [_runner(async_engine, batch_size=3) for _ in range(2)]
+
+    async def job(n: int) -> None:
+        ran.append(n)
+        await asyncio.sleep(0.01)
+
+    for runner in runners:
+        runner.durable(job)
+
+    async def main() -> None:
+        for n in range(10):
+            await runners[0].enqueue(job, n)
+        for runner in runners:
+            runner.start()
+        async with asyncio.timeout(5):
+            while len(ran) < 10:
+                await asyncio.sleep(0.01)
+        for runner in runners:
+            await runner.drain(timeout=1)
+
+    asyncio.run(main())
+    assert sorted(ran) == list(range(10))
+    assert session.exec(select(Job)).all() == []
+
+
+def test_failed_durable_jobs_are_retried(
+    session: Session, async_engine: AsyncEngine
+) -> None:
+    attempts: list[int] = []
+    runner = _runner(async_engine, max_attempts=2)
+
+    @runner.durable
+    async def always_fails() -> None:
+        attempts.append(len(attempts))
+        raise RuntimeError("never works")
+
+    async def main() -> None:
+        runner.start()
+        await runner.enqueue(always_fails)
+        async with asyncio.timeout(5):
+            while len(attempts) < 2 or session.exec(select(Job)).all():
+                await asyncio.sleep(0.01)
+        await runner.drain(timeout=1)
+
+    asyncio.run(main())
+    assert attempts == [0, 1]
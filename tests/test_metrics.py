@@ -0,0 +1,27 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from prometheus_client import CollectorRegistry, multiprocess
+
+INCREMENT = """
+from app.core.metrics import REQUESTS, REQUESTS_IN_PROGRESS, mark_process_dead
+REQUESTS.labels("GET", "/posts/", 200).inc()
+REQUESTS_IN_PROGRESS.inc()
+mark_process_dead()
+"""
+
+
+def test_metrics_aggregate_across_workers(tmp_path: Path) -> None:
+    for _ in range(2):
+        subprocess.run(
+            [sys.executable, "-c", INCREMENT],
+            env={"PROMETHEUS_MULTIPROC_DIR": str(tmp_path)},
+            check=True,
+        )
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=str(tmp_path))
+    labels = {"method": "GET", "route": "/posts/", "status": "200"}
+    assert registry.get_sample_value("http_requests_total", labels) == 2
+    # Live gauges drop workers that shut down
+    assert not registry.get_sample_value("http_requests_in_progress")
@@ -0,0 +1,94 @@
+import random
+from typing import Any
+
+import psycopg
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine, event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import Session
+
+from app.core.config import config
+from app.core.security import create_access_token
+from benchmarks.seed import PASSWORD, SeededData, seed
+
+
+@pytest.fixture
+def seeded(engine: Engine, session: Session) -> SeededData:  # noqa: ARG001
+    return seed(
+        engine,
+        users=20,
+        posts=500,
+        votes_per_user=10,
+        skew=1.1,
+        rng=random.Random(0),
+    )
+
+
+def _seq_scans(plan: dict[str, Any]) -> list[str]:
+    scans = [plan["Relation Name"]] if plan["Node Type"] == "Seq Scan" else []
+    for child in plan.get("Plans", []):
+        scans.extend(_seq_scans(child))
+    return scans
+
+
+def test_router_queries_use_indexes(
+    client: TestClient, async_engine: AsyncEngine, seeded: SeededData
+) -> None:
+    statements: list[tuple[str, Any]] = []
+
+    def record(
+        _conn: Any, _cursor: Any, statement: str, parameters: Any, *_args: Any
+    ) -> None:
+        statements.append((statement, parameters))
+
+    headers = {
+        "Authorization": "Bearer "
+        + create_access_token(data={"sub": str(seeded.user_ids[0])})
+    }
+    post_id = str(seeded.post_ids[0])
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        r = client.get("/posts/", params={"limit": 20})
+        client.get(
+            "/posts/", params={"limit": 20, "cursor": r.headers["X-Next-Cursor"]}
+        )
+        client.get("/posts/", params={"limit": 20, "published": True})
+        client.get("/posts/", params={"search": "post 4242"})
+        client.get(f"/posts/{post_id}")
+        client.get("/posts/trending", params={"limit": 20})
+        client.get("/posts/", params={"limit": 20}, headers=headers)
+        client.get(f"/posts/{post_id}", headers=headers)
+        client.post("/votes/", headers=headers, json={"post_id": post_id, "dir": 1})
+        client.post(
+            "/votes/batch", headers=headers, json=[{"post_id": post_id, "dir": 0}]
+        )
+        client.get("/users/me", headers=headers)
+        client.post(
+            "/token", data={"username": seeded.usernames[0], "password": PASSWORD}
+        )
+        r = client.post("/posts/", headers=headers, json={"title": "t", "content": "c"})
+        new_post_id = r.json()["id"]
+        client.put(f"/posts/{new_post_id}", headers=headers, json={"published": False})
+        client.delete(f"/posts/{new_post_id}", headers=headers)
+        client.post(
+            "/posts/bulk", headers=headers, json=[{"title": "t", "content": "c"}]
+        )
+        r = client.post("/logout/all", headers=headers)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+    assert r.status_code == status.HTTP_200_OK
+    # GET /posts/export reads whole tables on purpose, so it isn't covered
+
+    assert config.test_database_url
+    with psycopg.connect(str(config.test_database_url)) as connection:
+        # Tables this small are cheaper to scan whole, so make the planner pick
+        # any usable index. What still scans has no index to match the query
+        connection.execute("SET enable_seqscan = off")
+        for statement, parameters in statements:
+            (plan,) = connection.execute(
+                f"EXPLAIN (FORMAT JSON) {statement}", parameters
+            ).fetchone()  # ty:ignore[not-iterable]
+            scans = _seq_scans(plan[0]["Plan"])
+            assert not scans, f"Seq Scan on {scans} for:\n{statement}"
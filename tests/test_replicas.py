@@ -0,0 +1,96 @@
+import asyncio
+from collections.abc import Generator, Sequence
+from typing import Any
+
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from httpx import Headers
+from sqlalchemy import NullPool, event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app import deps
+from app.core.config import config
+from app.core.db import get_async_database_url
+from app.core.replicas import ReplicaRouter
+from app.models import Post
+
+
+def _replica_engine() -> AsyncEngine:
+    # The test database stands in for a replica that is in sync
+    assert config.test_database_url
+    return create_async_engine(
+        get_async_database_url(config.test_database_url), poolclass=NullPool
+    )
+
+
+def _unreachable_engine() -> AsyncEngine:
+    return create_async_engine(
+        "postgresql+psycopg://postgres@127.0.0.1:1/missing", poolclass=NullPool
+    )
+
+
+async def _picks(router: ReplicaRouter, count: int) -> list[AsyncEngine | None]:
+    return [await router.engine() for _ in range(count)]
+
+
+def test_router_takes_turns() -> None:
+    first, second = _replica_engine(), _replica_engine()
+    router = ReplicaRouter([first, second], timeout=1, ttl=60)
+    assert asyncio.run(_picks(router, 4)) == [first, second, first, second]
+
+
+def test_router_skips_unreachable_replicas() -> None:
+    healthy = _replica_engine()
+    router = ReplicaRouter([_unreachable_engine(), healthy], timeout=1, ttl=60)
+    assert asyncio.run(_picks(router, 3)) == [healthy, healthy, healthy]
+
+
+def test_router_falls_back_to_primary() -> None:
+    assert asyncio.run(_picks(ReplicaRouter([], timeout=1, ttl=60), 1)) == [None]
+    router = ReplicaRouter([_unreachable_engine()], timeout=1, ttl=60)
+    assert asyncio.run(_picks(router, 1)) == [None]
+
+
+@pytest.fixture
+def replica_statements(monkeypatch: pytest.MonkeyPatch) -> Generator[list[str]]:
+    replica = _replica_engine()
+    statements: list[str] = []
+
+    def record(_conn: Any, _cursor: Any, statement: str, *_args: Any) -> None:
+        statements.append(statement)
+
+    event.listen(replica.sync_engine, "before_cursor_execute", record)
+    monkeypatch.setattr(
+        deps, "read_replicas", ReplicaRouter([replica], timeout=1, ttl=60)
+    )
+    yield statements
+    event.remove(replica.sync_engine, "before_cursor_execute", record)
+
+
+def test_anonymous_reads_use_replica(
+    client: TestClient, db_posts: Sequence[Post], replica_statements: list[str]
+) -> None:
+    r = client.get(f"/posts/{db_posts[0].id}")
+    assert r.status_code == status.HTTP_200_OK
+    r = client.get("/posts/")
+    assert len(r.json()) == len(db_posts)
+    # The probe's SELECT 1, then one statement per read
+    assert len(replica_statements) == 3
+
+
+def test_signed_in_reads_and_writes_use_primary(
+    client: TestClient,
+    db_posts: Sequence[Post],
+    token_headers: Headers,
+    replica_statements: list[str],
+) -> None:
+    r = client.post(
+        "/posts/", headers=token_headers, json={"title": "new", "content": "new"}
+    )
+    assert r.status_code == status.HTTP_201_CREATED
+    r = client.get(f"/posts/{r.json()['id']}", headers=token_headers)
+    assert r.status_code == status.HTTP_200_OK
+    r = client.get("/posts/", headers=token_headers)
+    assert len(r.json()) == len(db_posts) + 1
+    assert replica_statements == []
@@ -0,0 +1,28 @@
+import time
+import uuid
+from datetime import timedelta
+
+from app.core.security import create_access_token, decode_token, verified_tokens
+
+
+def test_decode_token_is_cached() -> None:
+    user_id = uuid.uuid4()
+    token = create_access_token(data={"sub": str(user_id), "ver": 2})
+    hits, misses = verified_tokens.hits, verified_tokens.misses
+    principal = decode_token(token)
+    assert principal is not None
+    assert principal.id == user_id
+    assert principal.token_version == 2
+    assert decode_token(token) == principal
+    assert (verified_tokens.hits, verified_tokens.misses) == (hits + 1, misses + 1)
+    # A forged signature never matches the cached entry
+    assert decode_token(token[:-2] + "AA") is None
+
+
+def test_decode_token_cache_honours_expiry() -> None:
+    token = create_access_token(
+        data={"sub": str(uuid.uuid4())}, expires_delta=timedelta(seconds=1)
+    )
+    assert decode_token(token) is not None
+    time.sleep(1.1)
+    assert decode_token(token) is None
@@ -0,0 +1,68 @@
+import uuid
+from collections.abc import Sequence
+from typing import Any
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlmodel import Session, col, select
+
+from app.core.serialization import JSONBody
+from app.main import app
+from app.models import Post, PostPublicWithVotes, VoteResult
+
+
+def _serve_both_ways(response_model: Any, value: Any) -> tuple[bytes, bytes]:
+    """Render `value` through FastAPI's default path and through JSONBody."""
+    test_app = FastAPI()
+    body = JSONBody(response_model)
+
+    @test_app.get("/default", response_model=response_model)
+    def read_default() -> Any:
+        return value
+
+    @test_app.get("/fast", response_model=response_model)
+    def read_fast() -> Any:
+        return body.response(value)
+
+    with TestClient(test_app) as client:
+        default, fast = client.get("/default"), client.get("/fast")
+    assert default.headers["content-type"] == fast.headers["content-type"]
+    return default.content, fast.content
+
+
+def test_post_rows_serialize_byte_identical(
+    session: Session, db_posts: Sequence[Post]
+) -> None:
+    db_posts[0].title = 'żółw ☕ "quoted" \\ </script>'
+    session.add(db_posts[0])
+    session.commit()
+    rows = session.exec(select(Post, col(Post.vote_count).label("votes"))).all()
+    default, fast = _serve_both_ways(list[PostPublicWithVotes], rows)
+    assert fast == default
+    default, fast = _serve_both_ways(PostPublicWithVotes, rows[0])
+    assert fast == default
+
+
+@pytest.mark.parametrize("results", [[], [("added", 1), ("not_found", 0)]])
+def test_vote_results_serialize_byte_identical(
+    results: list[tuple[str, int]],
+) -> None:
+    value = [
+        VoteResult(post_id=uuid.uuid4(), dir=dir, status=vote_status)
+        for vote_status, dir in results
+    ]
+    default, fast = _serve_both_ways(list[VoteResult], value)
+    assert fast == default
+
+
+def test_fast_path_routes_keep_their_schema() -> None:
+    paths = app.openapi()["paths"]
+    schema = paths["/posts/"]["get"]["responses"]["200"]["content"]
+    assert schema["application/json"]["schema"]["items"] == {
+        "$ref": "#/components/schemas/PostPublicWithVotes"
+    }
+    schema = paths["/votes/batch"]["post"]["responses"]["200"]["content"]
+    assert schema["application/json"]["schema"]["items"] == {
+        "$ref": "#/components/schemas/VoteResult"
+    }
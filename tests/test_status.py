@@ -1,5 +1,14 @@
+from collections.abc import Sequence
+
+import pytest
 from fastapi import status
 from fastapi.testclient import TestClient
+from sqlalchemy import NullPool
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app.core.metrics import render_metrics
+from app.deps import database_probe
+from app.models import Post
 
 
 def test_health(client: TestClient) -> None:
@@ -7,3 +16,48 @@ def test_health(client: TestClient) -> None:
     assert r.status_code == status.HTTP_200_OK
     data = r.json()
     assert data["status"] == "ok"
+
+
+def test_health_live(client: TestClient) -> None:
+    r = client.get("/health/live")
+    assert r.status_code == status.HTTP_200_OK
+    assert r.headers["Server-Timing"].startswith('db;dur=0.0;desc="0 queries"')
+
+
+def test_health_ready(
+    client: TestClient, async_engine: AsyncEngine, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(database_probe, "engine", async_engine)
+    monkeypatch.setattr(database_probe, "_checked_at", None)
+    r = client.get("/health/ready")
+    assert r.status_code == status.HTTP_200_OK
+    # Answered from the last check, even though the database is now gone
+    monkeypatch.setattr(
+        database_probe,
+        "engine",
+        create_async_engine(
+            "postgresql+psycopg://postgres@localhost:1/app", poolclass=NullPool
+        ),
+    )
+    r = client.get("/health/ready")
+    assert r.status_code == status.HTTP_200_OK
+    monkeypatch.setattr(database_probe, "_checked_at", None)
+    r = client.get("/health/ready")
+    assert r.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+def test_metrics(client: TestClient, db_posts: Sequence[Post]) -> None:
+    client.get(f"/posts/{db_posts[0].id}")
+    # Only served on METRICS_PORT, out of reach of the public
+    r = client.get("/metrics")
+    assert r.status_code == status.HTTP_404_NOT_FOUND
+    content, _ = render_metrics()
+    text = content.decode()
+    # Labelled by route template, not by the post id
+    assert (
+        'http_requests_total{method="GET",route="/posts/{post_id}",status="200"}'
+        in text
+    )
+    assert str(db_posts[0].id) not in text
+    assert "db_pool_checkout_wait_seconds_bucket" in text
+    assert "event_loop_lag_seconds_count" in text
@@ -0,0 +1,58 @@
+import asyncio
+from collections.abc import Sequence
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import config
+from app.models import Post, PostScore
+from app.trending import refresh_post_scores
+
+
+def _refresh(async_engine: AsyncEngine) -> int:
+    async def refresh() -> int:
+        async with AsyncSession(async_engine) as session:
+            return await refresh_post_scores(session)
+
+    return asyncio.run(refresh())
+
+
+def _scores(session: Session) -> dict[str, float]:
+    session.expire_all()
+    return {
+        str(score.post_id): score.score for score in session.exec(select(PostScore))
+    }
+
+
+def test_refresh_only_rescores_changed_posts(
+    session: Session, async_engine: AsyncEngine, db_posts: Sequence[Post]
+) -> None:
+    assert _refresh(async_engine) == len(db_posts)
+    assert _refresh(async_engine) == 0
+    db_posts[0].vote_count = 3
+    session.add(db_posts[0])
+    session.commit()
+    assert _refresh(async_engine) == 1
+    assert len(_scores(session)) == len(db_posts)
+
+
+def test_scores_decay_with_age(
+    session: Session, async_engine: AsyncEngine, db_posts: Sequence[Post]
+) -> None:
+    now = datetime.now(UTC)
+    half_life = timedelta(hours=config.trending_half_life_hours)
+    new, old, older = db_posts
+    new.created_at, old.created_at = now, now - half_life
+    old.vote_count = 1
+    # Past the window, it drops out however many votes it has
+    older.created_at = now - timedelta(hours=config.trending_window_hours + 1)
+    older.vote_count = 100
+    session.add_all(db_posts)
+    session.commit()
+    _refresh(async_engine)
+    scores = _scores(session)
+    # One vote, doubling (1 + votes), makes up for one half-life of age
+    assert abs(scores[str(new.id)] - scores[str(old.id)]) < 1e-6
+    assert str(older.id) not in scores